@@ -9,7 +9,11 @@ Example usage:
 """
 import os
 import pathlib
-from collections.abc import Callable
+import re
+import signal
+import sys
+import time
+from collections.abc import Callable, Iterator
 from typing import Literal, TypeAlias
 
 import click
@@ -19,8 +23,19 @@ import orjson
 import pandas as pd
 import pendulum
 import smart_open
-
-from .functions import archive, gtfs
+from werkzeug import serving
+
+from .functions import (
+    archive,
+    cache,
+    export,
+    gtfs,
+    headways,
+    materialize,
+    model,
+    replay,
+    server,
+)
 
 APath: TypeAlias = cloudpathlib.CloudPath | pathlib.Path
 
@@ -67,6 +82,28 @@ def _pendulum_datetime(side: Literal["start"] | Literal["end"] = "start") -> Cal
     return _callback
 
 
+def _duration(
+    ctx: click.Context, param: click.Parameter, value: str
+) -> pendulum.Duration | None:
+    """Parameter callback for click to transform str such as 15m into a duration"""
+    if not value:
+        return None
+
+    match = re.fullmatch(r"(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?", value)
+    if not match or not any(match.groups()):
+        raise click.BadParameter("Must be a duration such as 30s, 15m, 1h or 1d")
+
+    days, hours, minutes, seconds = (int(group or 0) for group in match.groups())
+
+    duration = pendulum.duration(
+        days=days, hours=hours, minutes=minutes, seconds=seconds
+    )
+    if not duration:
+        raise click.BadParameter("Must be a positive duration")
+
+    return duration
+
+
 def _output_option() -> Callable:
     return click.option(
         "--output",
@@ -93,6 +130,15 @@ def _input_dir_option() -> Callable:
     )
 
 
+def _cache_dir_option() -> Callable:
+    return click.option(
+        "--cache-dir",
+        type=click.Path(file_okay=False, path_type=pathlib.Path),
+        default=lambda: os.environ.get("CACHE_DIR") or None,
+        show_default="$CACHE_DIR",
+    )
+
+
 def _dry_run_option() -> Callable:
     return click.option("--dry-run/--no-dry-run", type=bool, default=False)
 
@@ -122,14 +168,22 @@ def _limit_option() -> Callable:
     )
 
 
-def _format_option() -> Callable:
+def _format_option(choices: tuple[str, ...] = ("jsonl", "csv", "parquet")) -> Callable:
     return click.option(
         "--format",
-        type=click.Choice(["jsonl", "csv", "parquet"]),
+        type=click.Choice(choices),
         default="jsonl",
     )
 
 
+def _every_option() -> Callable:
+    return click.option(
+        "--every",
+        type=str,
+        callback=_duration,
+    )
+
+
 def _filter_option() -> Callable:
     return click.option(
         "--filter",
@@ -140,6 +194,25 @@ def _filter_option() -> Callable:
     )
 
 
+def _write_dataframe(
+    df: pd.DataFrame,
+    output: APath,
+    format: Literal["jsonl"] | Literal["csv"] | Literal["parquet"],
+) -> None:
+    # Ensure the specified output directory exists
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    with smart_open.open(str(output), "wb") as fout:
+        if format == "jsonl":
+            df.to_json(fout, orient="records", lines=True)
+
+        elif format == "csv":
+            df.to_csv(fout, index=False)
+
+        elif format == "parquet":
+            df.to_parquet(fout, index=False)
+
+
 @click.group()
 def cli() -> None:
     """Run cli commands"""
@@ -162,9 +235,68 @@ def version() -> None:
     show_default="$OUTPUT_DIR",
 )
 @_dry_run_option()
-def snapshot(api_token: str, output_dir: APath, dry_run: bool) -> None:
-    """Snapshot and archive all realtime feeds."""
-    archive.snapshot_all(api_token=api_token, output_dir=output_dir, is_dryrun=dry_run)
+@click.option("--continuous/--no-continuous", type=bool, default=False)
+@click.option("--interval", type=float, default=15.0, show_default=True)
+@click.option("--batch-size", type=int, default=20, show_default=True)
+@click.option("--batch-seconds", type=float, default=300.0, show_default=True)
+def snapshot(
+    api_token: str,
+    output_dir: APath,
+    dry_run: bool,
+    continuous: bool,
+    interval: float,
+    batch_size: int,
+    batch_seconds: float,
+) -> None:
+    """Snapshot and archive all realtime feeds.
+
+    With --continuous, feeds are snapshotted every --interval seconds and
+    archived in batches of up to --batch-size snapshots or --batch-seconds.
+    """
+    if not continuous:
+        archive.snapshot_all(
+            api_token=api_token, output_dir=output_dir, is_dryrun=dry_run
+        )
+        return
+
+    # Exit normally on SIGTERM so buffered snapshots are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    with archive.BatchWriter(
+        output_dir, max_snapshots=batch_size, max_seconds=batch_seconds
+    ) as writer:
+        try:
+            while True:
+                started_at = time.monotonic()
+
+                try:
+                    archive.snapshot_all(
+                        api_token=api_token,
+                        output_dir=output_dir,
+                        is_dryrun=dry_run,
+                        writer=writer,
+                    )
+                except (RuntimeError, OSError) as e:
+                    click.echo(f"Could not snapshot feeds: {e}", err=True)
+
+                time.sleep(max(interval - (time.monotonic() - started_at), 0))
+
+        except KeyboardInterrupt:
+            pass
+
+
+@cli.command(name="serve")
+@_api_token_option()
+@click.option("--ttl", type=float, default=30.0, show_default=True)
+@click.option("--host", type=str, default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8080, show_default=True)
+def serve_feeds(api_token: str, ttl: float, host: str, port: int) -> None:
+    """Serve cached latest realtime feeds to internal consumers."""
+    feed_cache = cache.LatestFeedCache(api_token, ttl=ttl)
+    app = server.create_app(feed_cache.get_snapshot)
+
+    click.echo(f"Serving latest feeds at http://{host}:{port}/gtfsrt")
+    serving.run_simple(host, port, app, threaded=True)
 
 
 @cli.group("api")
@@ -229,11 +361,16 @@ def archive_group() -> None:
 @_start_option()
 @_end_option()
 @_limit_option()
+@_every_option()
 def archive_retrieve_tripupdates(
-    input_dir: APath, start: pendulum.DateTime, end: pendulum.DateTime, limit: int
+    input_dir: APath,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    limit: int,
+    every: pendulum.Duration | None,
 ) -> None:
     """Display archived trip update feeds."""
-    feeds = archive.retrieve_tripupdate_feeds(input_dir, start, end, limit)
+    feeds = archive.retrieve_tripupdate_feeds(input_dir, start, end, limit, every=every)
     for feed in feeds:
         click.echo(feed)
 
@@ -244,39 +381,169 @@ def archive_retrieve_tripupdates(
 @_end_option()
 @_filter_option()
 @_limit_option()
+@_every_option()
 @_output_option()
-@_format_option()
+@_format_option(("jsonl", "csv", "parquet", "dataset"))
+@click.option(
+    "--partition-by-route/--no-partition-by-route",
+    type=bool,
+    default=False,
+)
+@click.option(
+    "--replace-partitions/--append-partitions",
+    type=bool,
+    default=False,
+)
+@click.option(
+    "--incremental/--no-incremental",
+    type=bool,
+    default=False,
+)
+@_cache_dir_option()
 def archive_retrieve_vehicles(
     input_dir: APath,
     start: pendulum.DateTime,
     end: pendulum.DateTime,
     filter: dict[str, str] | None,
     limit: int | None,
+    every: pendulum.Duration | None,
     output: APath | None,
-    format: Literal["jsonl"] | Literal["csv"] | Literal["parquet"],
+    format: (
+        Literal["jsonl"] | Literal["csv"] | Literal["parquet"] | Literal["dataset"]
+    ),
+    partition_by_route: bool,
+    replace_partitions: bool,
+    incremental: bool,
+    cache_dir: pathlib.Path | None,
 ) -> None:
-    """Display archived vehicles feeds."""
-    vehicles = archive.retrieve_vehicle_positions(input_dir, start, end, filter, limit)
+    """Display archived vehicles feeds.
+
+    Days materialized in --cache-dir are read from the cache rather than
+    decoded from the archive, unless downsampling with --every or snapshots
+    have been archived since the day was materialized. Without --input-dir,
+    only cached days are read.
+    """
+    if incremental:
+        if format != "dataset" or not output:
+            raise click.UsageError(
+                "Incremental exports require --format dataset and --output"
+            )
 
-    if output:
-        vehicle_df = pd.DataFrame(vehicles)
+        if limit or every or replace_partitions:
+            raise click.UsageError(
+                "Incremental exports do not support --limit, --every or "
+                "--replace-partitions"
+            )
 
-        # Ensure the specified output directory exists
-        output.parent.mkdir(parents=True, exist_ok=True)
+        num_rows, watermark = export.export_vehicle_positions_incremental(
+            input_dir,
+            output,
+            start,
+            end,
+            filter,
+            partition_by_route=partition_by_route,
+        )
+        click.echo(
+            f"Exported {num_rows} vehicle positions to {output} up to {watermark}"
+        )
+        return
+
+    vehicles: Iterator[model.VehiclePosition]
+    if cache_dir and not every:
+        vehicles = materialize.retrieve_vehicle_positions(
+            input_dir, cache_dir, start, end, filter, limit
+        )
+    else:
+        vehicles = archive.retrieve_vehicle_positions(
+            input_dir, start, end, filter, limit, every=every
+        )
+
+    if format == "dataset":
+        if not output:
+            raise click.UsageError("Must specify --output for dataset exports")
+
+        num_rows = export.write_vehicle_positions_dataset(
+            vehicles,
+            output,
+            partition_by_route=partition_by_route,
+            replace_partitions=replace_partitions,
+        )
+        click.echo(f"Exported {num_rows} vehicle positions to {output}")
+
+    elif output:
+        vehicle_df = pd.DataFrame([vehicle.to_dict() for vehicle in vehicles])
+        _write_dataframe(vehicle_df, output, format)
 
-        with smart_open.open(str(output), "wb") as fout:
-            if format == "jsonl":
-                vehicle_df.to_json(fout, orient="records", lines=True)
+    else:
+        for vehicle in vehicles:
+            click.echo(orjson.dumps(vehicle.to_dict()))
 
-            elif format == "csv":
-                vehicle_df.to_csv(fout, index=False)
 
-            elif format == "parquet":
-                vehicle_df.to_parquet(fout, index=False)
+@archive_group.command(name="compute-headways")
+@click.option(
+    "--dataset-dir",
+    type=str,
+    callback=_cloud_path,
+    required=True,
+)
+@_start_option()
+@_end_option()
+@click.option(
+    "--report",
+    type=click.Choice(["arrivals", "headways", "summary"]),
+    default="summary",
+)
+@_output_option()
+@_format_option()
+def archive_compute_headways(
+    dataset_dir: APath,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    report: Literal["arrivals"] | Literal["headways"] | Literal["summary"],
+    output: APath | None,
+    format: Literal["jsonl"] | Literal["csv"] | Literal["parquet"],
+) -> None:
+    """Compute stop arrivals and headways from a vehicle positions dataset."""
+    batches = headways.read_position_batches(dataset_dir, start.date(), end.date())
+
+    # Arrivals are much smaller than positions, so are collected across batches
+    arrival_batches = [headways.arrival_events(positions) for positions in batches]
+    if not arrival_batches:
+        raise click.ClickException(f"No vehicle positions found in {dataset_dir}")
+
+    arrivals = pd.concat(arrival_batches, ignore_index=True)
 
+    if report == "arrivals":
+        report_df = arrivals
+    elif report == "headways":
+        report_df = headways.headways(arrivals)
     else:
-        for vehicle in vehicles:
-            click.echo(orjson.dumps(vehicle))
+        report_df = headways.headway_summary(headways.headways(arrivals))
+
+    if output:
+        _write_dataframe(report_df, output, format)
+    else:
+        click.echo(report_df.to_json(orient="records", lines=True))
+
+
+@archive_group.command(name="materialize")
+@_input_dir_option()
+@_cache_dir_option()
+@_start_option()
+@_end_option()
+def archive_materialize(
+    input_dir: APath,
+    cache_dir: pathlib.Path | None,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+) -> None:
+    """Decode archived vehicle positions into a local Arrow cache."""
+    if not cache_dir:
+        raise click.UsageError("Must specify --cache-dir or $CACHE_DIR")
+
+    cached = materialize.materialize_vehicle_positions(input_dir, cache_dir, start, end)
+    for path, num_rows in cached:
+        click.echo(f"Materialized {num_rows} vehicle positions to {path}")
 
 
 @archive_group.command(name="retrieve-alerts")
@@ -284,14 +551,60 @@ def archive_retrieve_vehicles(
 @_start_option()
 @_end_option()
 @_limit_option()
+@_every_option()
 def archive_retrieve_alerts(
-    input_dir: APath, start: pendulum.DateTime, end: pendulum.DateTime, limit: int
+    input_dir: APath,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    limit: int,
+    every: pendulum.Duration | None,
 ) -> None:
     """Display archived alert feeds."""
-    feeds = archive.retrieve_alert_feeds(input_dir, start, end, limit)
+    feeds = archive.retrieve_alert_feeds(input_dir, start, end, limit, every=every)
     for feed in feeds:
         click.echo(feed)
 
 
+@cli.command(name="replay")
+@_input_dir_option()
+@_start_option()
+@_end_option()
+@click.option(
+    "--speed",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="Playback speed multiplier, or 0 to replay as fast as possible.",
+)
+@click.option("--loop/--no-loop", type=bool, default=False)
+@click.option("--host", type=str, default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8080, show_default=True)
+def replay_feeds(
+    input_dir: APath,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    speed: float,
+    loop: bool,
+    host: str,
+    port: int,
+) -> None:
+    """Serve archived feeds as a live GTFS-RT feed."""
+    replayer = replay.Replayer(input_dir, start, end, speed=speed, loop=loop)
+    app = server.create_app(replayer.get_snapshot)
+
+    http_server = serving.make_server(host, port, app, threaded=True)
+
+    click.echo(f"Replaying {input_dir} at http://{host}:{port}/gtfsrt")
+    replayer.start_background()
+
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        replayer.stop()
+        http_server.server_close()
+
+
 if __name__ == "__main__":
     cli()
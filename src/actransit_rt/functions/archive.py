@@ -3,13 +3,31 @@
 /actransit/realtime/tripupdates/2024/02/15/1703994731.tripupdates.pb.gz
 /actransit/realtime/alerts/2024/02/15/1703994731.alerts.pb.gz
 /actransit/realtime/vehicles/2024/02/15/1703994731.vehicles.pb.gz
+
+Continuous capture may instead write batches of snapshots, named by their first
+and last snapshot timestamps:
+
+/actransit/realtime/vehicles/2024/02/15/1703994731-1703995031.vehicles.batch
+
+A batch starts with a JSON index line listing the timestamp, offset and length
+of each snapshot, followed by the individually gzipped snapshots. Offsets are
+relative to the end of the index line.
 """
 
+import dataclasses
+import functools
+import gzip
+import heapq
+import os
 import pathlib
-from collections.abc import Iterator
+import time
+import uuid
+from collections.abc import Iterable, Iterator
+from types import TracebackType
 from typing import TypeAlias
 
 import cloudpathlib
+import orjson
 import pendulum
 import smart_open
 from google.transit import gtfs_realtime_pb2
@@ -30,19 +48,162 @@ def output_path(kind: str, output_dir: APath, timestamp: int) -> APath:
     return base_path(kind, output_dir, day) / f"{timestamp}.{kind}.pb.gz"
 
 
-def snapshot_all(api_token: str, output_dir: APath, is_dryrun: bool = False) -> None:
-    snapshot_tripupdates_feed(api_token, output_dir, is_dryrun=is_dryrun)
-    snapshot_alerts_feed(api_token, output_dir, is_dryrun=is_dryrun)
-    snapshot_vehicles_feed(api_token, output_dir, is_dryrun=is_dryrun)
+def batch_path(
+    kind: str, output_dir: APath, first_timestamp: int, last_timestamp: int
+) -> APath:
+    day = pendulum.from_timestamp(first_timestamp, tz="UTC")
+    return (
+        base_path(kind, output_dir, day)
+        / f"{first_timestamp}-{last_timestamp}.{kind}.batch"
+    )
+
+
+class BatchWriter:
+    """Buffers snapshots in memory and writes one batch object per feed kind.
+
+    A kind's batch is flushed once it holds max_snapshots snapshots, when a
+    snapshot is added max_seconds after the batch was started, or when the
+    next snapshot falls on another UTC day so each batch is stored under the
+    day of all its snapshots. Snapshots with an unchanged header timestamp are
+    skipped, but still flush a batch which has reached max_seconds, so a
+    stalled feed is written out. Remaining snapshots are flushed when the
+    writer is closed.
+    """
+
+    def __init__(
+        self, output_dir: APath, max_snapshots: int = 20, max_seconds: float = 300.0
+    ) -> None:
+        self.output_dir = output_dir
+        self.max_snapshots = max_snapshots
+        self.max_seconds = max_seconds
+
+        self._buffers: dict[str, list[tuple[int, bytes]]] = {}
+        self._started_at: dict[str, float] = {}
+        self._last_timestamps: dict[str, int] = {}
+
+    def _is_expired(self, kind: str) -> bool:
+        return time.monotonic() - self._started_at[kind] >= self.max_seconds
+
+    def add(self, kind: str, feed: gtfs_realtime_pb2.FeedMessage) -> None:
+        timestamp = int(feed.header.timestamp)
+
+        buffer = self._buffers.setdefault(kind, [])
+
+        # Checked before skipping unchanged snapshots, so a stalled feed's
+        # batch is still flushed once it is max_seconds old
+        if buffer and self._is_expired(kind):
+            self.flush(kind)
+
+        if self._last_timestamps.get(kind) == timestamp:
+            return
+
+        self._last_timestamps[kind] = timestamp
+
+        if buffer and _utc_day(buffer[0][0]) != _utc_day(timestamp):
+            self.flush(kind)
+
+        if not buffer:
+            self._started_at[kind] = time.monotonic()
+
+        buffer.append((timestamp, gzip.compress(feed.SerializeToString())))
+
+        if len(buffer) >= self.max_snapshots or self._is_expired(kind):
+            self.flush(kind)
+
+    def flush(self, kind: str | None = None) -> None:
+        kinds = [kind] if kind is not None else list(self._buffers)
+
+        for kind in kinds:
+            buffer = self._buffers.get(kind)
+            if not buffer:
+                continue
+
+            output = batch_path(kind, self.output_dir, buffer[0][0], buffer[-1][0])
+
+            print(f"Writing batch of {len(buffer)} {kind} to {output}")
+
+            index = []
+            offset = 0
+            for timestamp, data in buffer:
+                index.append([timestamp, offset, len(data)])
+                offset += len(data)
+
+            header = orjson.dumps({"kind": kind, "snapshots": index}) + b"\n"
+            _write_batch(output, [header] + [data for _, data in buffer])
+
+            buffer.clear()
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+
+def _write_batch(output: APath, chunks: list[bytes]) -> None:
+    """Local batches are written to a temporary file and renamed into place, so
+    readers never see a partially written batch. Cloud objects only become
+    visible once fully uploaded, so are written directly.
+    """
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    if isinstance(output, cloudpathlib.CloudPath):
+        with smart_open.open(str(output), "wb") as fout:
+            for chunk in chunks:
+                fout.write(chunk)
+        return
+
+    tmp_output = output.with_name(f".{output.name}.{uuid.uuid4().hex}")
+    with open(tmp_output, "wb") as fout:
+        for chunk in chunks:
+            fout.write(chunk)
+        fout.flush()
+        os.fsync(fout.fileno())
+
+    os.replace(tmp_output, output)
+
+
+def _utc_day(timestamp: int) -> pendulum.Date:
+    return pendulum.from_timestamp(timestamp, tz="UTC").date()
+
+
+def snapshot_all(
+    api_token: str,
+    output_dir: APath,
+    is_dryrun: bool = False,
+    writer: BatchWriter | None = None,
+) -> None:
+    snapshot_tripupdates_feed(api_token, output_dir, is_dryrun=is_dryrun, writer=writer)
+    snapshot_alerts_feed(api_token, output_dir, is_dryrun=is_dryrun, writer=writer)
+    snapshot_vehicles_feed(api_token, output_dir, is_dryrun=is_dryrun, writer=writer)
 
 
 def snapshot_tripupdates_feed(
-    api_token: str, output_dir: APath, is_dryrun: bool = False
+    api_token: str,
+    output_dir: APath,
+    is_dryrun: bool = False,
+    writer: BatchWriter | None = None,
 ) -> None:
     feed = gtfs.retrieve_tripupdates_feed(token=api_token)
 
     timestamp = int(feed.header.timestamp)
 
+    if writer is not None:
+        print(f"Buffering {len(feed.entity)} tripupdates at {timestamp}")
+
+        if not is_dryrun:
+            writer.add("tripupdates", feed)
+
+        return
+
     output = output_path("tripupdates", output_dir, timestamp)
 
     print(f"Snapshotting {len(feed.entity)} tripupdates to {output}")
@@ -58,12 +219,23 @@ def snapshot_tripupdates_feed(
 
 
 def snapshot_alerts_feed(
-    api_token: str, output_dir: APath, is_dryrun: bool = False
+    api_token: str,
+    output_dir: APath,
+    is_dryrun: bool = False,
+    writer: BatchWriter | None = None,
 ) -> None:
     feed = gtfs.retrieve_alerts_feed(token=api_token)
 
     timestamp = int(feed.header.timestamp)
 
+    if writer is not None:
+        print(f"Buffering {len(feed.entity)} alerts at {timestamp}")
+
+        if not is_dryrun:
+            writer.add("alerts", feed)
+
+        return
+
     output = output_path("alerts", output_dir, timestamp)
 
     print(f"Snapshotting {len(feed.entity)} alerts to {output}")
@@ -79,12 +251,23 @@ def snapshot_alerts_feed(
 
 
 def snapshot_vehicles_feed(
-    api_token: str, output_dir: APath, is_dryrun: bool = False
+    api_token: str,
+    output_dir: APath,
+    is_dryrun: bool = False,
+    writer: BatchWriter | None = None,
 ) -> None:
     feed = gtfs.retrieve_vehicles_feed(token=api_token)
 
     timestamp = int(feed.header.timestamp)
 
+    if writer is not None:
+        print(f"Buffering {len(feed.entity)} vehicles at {timestamp}")
+
+        if not is_dryrun:
+            writer.add("vehicles", feed)
+
+        return
+
     output = output_path("vehicles", output_dir, timestamp)
 
     print(f"Snapshotting {len(feed.entity)} vehicles to {output}")
@@ -99,60 +282,182 @@ def snapshot_vehicles_feed(
         fout.write(feed_bytes)
 
 
-def retrieve_tripupdate_feeds(
-    base_dir: APath, start: pendulum.DateTime, end: pendulum.DateTime, limit: int
-) -> Iterator[gtfs_realtime_pb2.FeedMessage]:
+def snapshot_timestamp(feed_path: APath) -> int:
+    """Parse the snapshot timestamp from an archived feed filename."""
+    return int(feed_path.name.split(".", 1)[0])
+
+
+def batch_timestamps(batch_path: APath) -> tuple[int, int]:
+    """Parse the first and last snapshot timestamps from a batch filename."""
+    first, last = batch_path.name.split(".", 1)[0].split("-")
+    return int(first), int(last)
+
+
+@dataclasses.dataclass(frozen=True)
+class ArchivedFeed:
+    """A snapshot stored in its own object, or at an offset within a batch"""
+
+    timestamp: int
+    path: APath
+    offset: int | None = None
+    length: int | None = None
+
+
+def read_batch_index(batch_path: APath) -> list[ArchivedFeed]:
+    """Read the snapshots of a batch from its index line."""
+    with smart_open.open(str(batch_path), "rb") as fin:
+        index = orjson.loads(fin.readline())
+
+    return [
+        ArchivedFeed(timestamp=timestamp, path=batch_path, offset=offset, length=length)
+        for timestamp, offset, length in index["snapshots"]
+    ]
+
+
+def list_archived_feeds(
+    kind: str,
+    base_dir: APath,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    after: int | None = None,
+    until: int | None = None,
+    every: pendulum.Duration | None = None,
+) -> Iterator[ArchivedFeed]:
+    """List archived snapshots of a kind in timestamp order.
+
+    Snapshots are selected by the days spanned by start and end, and optionally
+    restricted to timestamps greater than after and at most until. Batches
+    entirely outside those bounds are skipped without reading their index.
+
+    With every, snapshots are downsampled to the first snapshot at or after
+    each interval boundary counted from start, using only archived timestamps.
+    """
+    every_seconds = int(every.total_seconds()) if every else None
+    if every_seconds is not None and every_seconds <= 0:
+        raise ValueError("Downsampling interval must be positive")
+
+    previous_bucket = None
+
     start_date = start.in_tz("UTC").date()
     end_date = end.in_tz("UTC").date()
 
     num_days = end_date.diff(start_date).in_days()
 
-    num_records = 0
     for i in range(num_days + 1):
         day = start_date.add(days=i)
 
-        output_path = base_path("tripupdates", base_dir, day)
-        feed_paths = output_path.glob("*.tripupdates.pb.gz")
+        output_path = base_path(kind, base_dir, day)
 
-        for feed_path in feed_paths:
-            if limit and num_records >= limit:
-                break
+        archived_feeds = [
+            ArchivedFeed(timestamp=snapshot_timestamp(feed_path), path=feed_path)
+            for feed_path in output_path.glob(f"*.{kind}.pb.gz")
+        ]
 
-            with smart_open.open(str(feed_path), "rb") as fin:
-                feed = gtfs_realtime_pb2.FeedMessage()
-                feed.ParseFromString(fin.read())
+        for batch_path in output_path.glob(f"*.{kind}.batch"):
+            first, last = batch_timestamps(batch_path)
 
-                yield feed
+            if (after is not None and last <= after) or (
+                until is not None and first > until
+            ):
+                continue
 
-            num_records += 1
+            archived_feeds.extend(read_batch_index(batch_path))
 
+        archived_feeds.sort(key=lambda archived_feed: archived_feed.timestamp)
 
-def retrieve_alert_feeds(
-    base_dir: APath, start: pendulum.DateTime, end: pendulum.DateTime, limit: int
+        previous_timestamp = None
+        for archived_feed in archived_feeds:
+            timestamp = archived_feed.timestamp
+
+            # A snapshot may be stored both individually and within a batch
+            if timestamp == previous_timestamp:
+                continue
+
+            previous_timestamp = timestamp
+
+            if after is not None and timestamp <= after:
+                continue
+
+            if until is not None and timestamp > until:
+                return
+
+            if every_seconds is not None:
+                bucket = (timestamp - start.int_timestamp) // every_seconds
+                if bucket == previous_bucket:
+                    continue
+
+                previous_bucket = bucket
+
+            yield archived_feed
+
+
+@functools.lru_cache(maxsize=8)
+def _read_batch_data(batch_path: str) -> bytes:
+    """Snapshots of a batch, cached as batches are typically read in sequence"""
+    with smart_open.open(batch_path, "rb") as fin:
+        fin.readline()
+        return fin.read()
+
+
+def read_feed(archived_feed: ArchivedFeed) -> gtfs_realtime_pb2.FeedMessage:
+    feed = gtfs_realtime_pb2.FeedMessage()
+
+    if archived_feed.offset is None or archived_feed.length is None:
+        with smart_open.open(str(archived_feed.path), "rb") as fin:
+            feed.ParseFromString(fin.read())
+
+    else:
+        data = _read_batch_data(str(archived_feed.path))
+        start = archived_feed.offset
+        feed.ParseFromString(
+            gzip.decompress(data[start : start + archived_feed.length])
+        )
+
+    return feed
+
+
+def retrieve_tripupdate_feeds(
+    base_dir: APath,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    limit: int,
+    after: int | None = None,
+    until: int | None = None,
+    every: pendulum.Duration | None = None,
 ) -> Iterator[gtfs_realtime_pb2.FeedMessage]:
-    start_date = start.in_tz("UTC").date()
-    end_date = end.in_tz("UTC").date()
+    archived_feeds = list_archived_feeds(
+        "tripupdates", base_dir, start, end, after, until, every
+    )
 
-    num_days = end_date.diff(start_date).in_days()
+    for num_records, archived_feed in enumerate(archived_feeds):
+        if limit and num_records >= limit:
+            break
 
-    num_records = 0
-    for i in range(num_days + 1):
-        day = start_date.add(days=i)
+        yield read_feed(archived_feed)
 
-        output_path = base_path("alerts", base_dir, day)
-        feed_paths = output_path.glob("*.alerts.pb.gz")
 
-        for feed_path in feed_paths:
-            if limit and num_records >= limit:
-                break
+def retrieve_alert_feeds(
+    base_dir: APath,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    limit: int,
+    after: int | None = None,
+    until: int | None = None,
+    every: pendulum.Duration | None = None,
+) -> Iterator[gtfs_realtime_pb2.FeedMessage]:
+    archived_feeds = list_archived_feeds(
+        "alerts", base_dir, start, end, after, until, every
+    )
 
-            with smart_open.open(str(feed_path), "rb") as fin:
-                feed = gtfs_realtime_pb2.FeedMessage()
-                feed.ParseFromString(fin.read())
+    for num_records, archived_feed in enumerate(archived_feeds):
+        if limit and num_records >= limit:
+            break
 
-                yield feed
+        yield read_feed(archived_feed)
 
-            num_records += 1
+
+def matches_filter(vehicle: model.VehiclePosition, filter: dict[str, str]) -> bool:
+    return all(getattr(vehicle, key) == value for key, value in filter.items())
 
 
 def retrieve_vehicle_positions(
@@ -161,46 +466,138 @@ def retrieve_vehicle_positions(
     end: pendulum.DateTime,
     filter: dict[str, str] | None = None,
     limit: int | None = None,
+    after: int | None = None,
+    until: int | None = None,
+    every: pendulum.Duration | None = None,
 ) -> Iterator[model.VehiclePosition]:
-    start_date = start.in_tz("UTC").date()
-    end_date = end.in_tz("UTC").date()
-
-    num_days = end_date.diff(start_date).in_days()
+    archived_feeds = list_archived_feeds(
+        "vehicles", base_dir, start, end, after, until, every
+    )
 
     num_records = 0
-    for i in range(num_days + 1):
+    for archived_feed in archived_feeds:
         if limit and num_records >= limit:
             break
 
-        day = start_date.add(days=i)
-
-        output_path = base_path("vehicles", base_dir, day)
-        feed_paths = output_path.glob("*.vehicles.pb.gz")
+        feed = read_feed(archived_feed)
 
-        for feed_path in feed_paths:
+        for entity in feed.entity:
             if limit and num_records >= limit:
                 break
 
-            with smart_open.open(str(feed_path), "rb") as fin:
-                feed = gtfs_realtime_pb2.FeedMessage()
-                feed.ParseFromString(fin.read())
+            vehicle = model.VehiclePosition.from_feed(entity)
 
-            for entity in feed.entity:
-                if limit and num_records >= limit:
-                    break
+            if filter and not matches_filter(vehicle, filter):
+                continue
 
-                vehicle = model.VehiclePosition.from_feed(entity)
+            yield vehicle
 
-                is_match = True
-                if filter:
-                    for key, value in filter.items():
-                        if getattr(vehicle, key) != value:
-                            is_match = False
-                            break
+            num_records += 1
+
+
+@dataclasses.dataclass(frozen=True)
+class FeedFrame:
+    """Latest snapshot of each feed kind as of a snapshot of one kind"""
+
+    timestamp: int
+    kind: str
+    tripupdates: gtfs_realtime_pb2.FeedMessage | None = None
+    vehicles: gtfs_realtime_pb2.FeedMessage | None = None
+    alerts: gtfs_realtime_pb2.FeedMessage | None = None
 
-                if not is_match:
-                    continue
 
-                yield vehicle
+def _kind_archived_feeds(
+    kind: str, archived_feeds: Iterator[ArchivedFeed]
+) -> Iterator[tuple[int, str, ArchivedFeed]]:
+    for archived_feed in archived_feeds:
+        yield archived_feed.timestamp, kind, archived_feed
 
-                num_records += 1
+
+def retrieve_feed_frames(
+    base_dir: APath,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    after: int | None = None,
+    until: int | None = None,
+    every: pendulum.Duration | None = None,
+) -> Iterator[FeedFrame]:
+    """Stream trip updates, vehicles and alerts merged by snapshot timestamp.
+
+    A frame is yielded for each snapshot, holding it alongside the latest
+    snapshot of the other kinds. Snapshots are merged by their archived
+    timestamps with a heap before being read, so only the latest snapshot of
+    each kind is held in memory.
+    """
+    streams = [
+        _kind_archived_feeds(
+            kind, list_archived_feeds(kind, base_dir, start, end, after, until, every)
+        )
+        for kind in ("tripupdates", "vehicles", "alerts")
+    ]
+
+    latest: dict[str, gtfs_realtime_pb2.FeedMessage] = {}
+    for timestamp, kind, archived_feed in heapq.merge(
+        *streams, key=lambda item: item[:2]
+    ):
+        latest[kind] = read_feed(archived_feed)
+
+        yield FeedFrame(timestamp=timestamp, kind=kind, **latest)
+
+
+def _find_stop_time_update(
+    trip_update: gtfs_realtime_pb2.TripUpdate, vehicle: model.VehiclePosition
+) -> gtfs_realtime_pb2.TripUpdate.StopTimeUpdate | None:
+    if vehicle.current_stop_sequence is not None:
+        for update in trip_update.stop_time_update:
+            if (
+                update.HasField("stop_sequence")
+                and update.stop_sequence == vehicle.current_stop_sequence
+            ):
+                return update
+
+    if vehicle.stop_id is not None:
+        for update in trip_update.stop_time_update:
+            if update.HasField("stop_id") and update.stop_id == vehicle.stop_id:
+                return update
+
+    return None
+
+
+def join_stop_time_updates(
+    frames: Iterable[FeedFrame],
+) -> Iterator[
+    tuple[model.VehiclePosition, gtfs_realtime_pb2.TripUpdate.StopTimeUpdate | None]
+]:
+    """As-of join of each vehicle snapshot to its trip's current stop prediction.
+
+    Vehicles are matched to the stop time update of their trip with the same
+    stop sequence, or failing that the same stop id, in the latest trip updates.
+    """
+    trip_updates: dict[str, gtfs_realtime_pb2.TripUpdate] = {}
+    indexed: gtfs_realtime_pb2.FeedMessage | None = None
+
+    for frame in frames:
+        if frame.kind != "vehicles" or frame.vehicles is None:
+            continue
+
+        # Trip updates are only re-indexed when a new snapshot arrives
+        if frame.tripupdates is not indexed:
+            indexed = frame.tripupdates
+            trip_updates = {
+                entity.trip_update.trip.trip_id: entity.trip_update
+                for entity in (indexed.entity if indexed is not None else [])
+                if entity.HasField("trip_update")
+            }
+
+        for entity in frame.vehicles.entity:
+            vehicle = model.VehiclePosition.from_feed(entity)
+
+            trip_update = trip_updates.get(vehicle.trip_id or "")
+
+            stop_time_update = (
+                _find_stop_time_update(trip_update, vehicle)
+                if trip_update is not None
+                else None
+            )
+
+            yield vehicle, stop_time_update
@@ -0,0 +1,77 @@
+"""Cache of the latest realtime feeds
+
+Keeps the latest snapshot of each feed kind in memory so that a single
+upstream request serves every internal consumer until the feed is expected to
+have been updated.
+"""
+
+import threading
+import time
+
+from google.transit import gtfs_realtime_pb2
+
+from . import gtfs, server
+
+
+class LatestFeedCache:
+    """Latest snapshot of each feed kind, refreshed from the AC Transit API.
+
+    A snapshot is fresh until ttl seconds after its header timestamp, after
+    which the next request refreshes it. Refreshes are attempted at most once
+    every min_interval seconds, so a feed which has stopped updating does not
+    cause a request to upstream for every client. Concurrent requests for an
+    expired feed share a single refresh. If a refresh fails, the stale
+    snapshot continues to be served.
+    """
+
+    def __init__(
+        self, api_token: str, ttl: float = 30.0, min_interval: float = 5.0
+    ) -> None:
+        self.api_token = api_token
+        self.ttl = ttl
+        self.min_interval = min_interval
+
+        self._snapshots: dict[str, server.FeedSnapshot] = {}
+        self._refreshed_at: dict[str, float] = {}
+        self._locks = {kind: threading.Lock() for kind in server.FEED_KINDS}
+
+    def _retrieve(self, kind: str) -> gtfs_realtime_pb2.FeedMessage:
+        retrievers = {
+            "tripupdates": gtfs.retrieve_tripupdates_feed,
+            "vehicles": gtfs.retrieve_vehicles_feed,
+            "alerts": gtfs.retrieve_alerts_feed,
+        }
+
+        return retrievers[kind](token=self.api_token)
+
+    def _is_fresh(self, kind: str, now: float) -> bool:
+        snapshot = self._snapshots.get(kind)
+        if snapshot is None:
+            return False
+
+        if now < snapshot.timestamp + self.ttl:
+            return True
+
+        return now < self._refreshed_at.get(kind, 0) + self.min_interval
+
+    def get_snapshot(self, kind: str) -> server.FeedSnapshot | None:
+        if self._is_fresh(kind, time.time()):
+            return self._snapshots[kind]
+
+        with self._locks[kind]:
+            # Another request may have refreshed while waiting on the lock
+            now = time.time()
+            if self._is_fresh(kind, now):
+                return self._snapshots[kind]
+
+            self._refreshed_at[kind] = now
+
+            try:
+                feed = self._retrieve(kind)
+            except (RuntimeError, OSError) as e:
+                print(f"Could not refresh {kind} feed: {e}")
+                return self._snapshots.get(kind)
+
+            self._snapshots[kind] = server.FeedSnapshot.from_feed(kind, feed)
+
+        return self._snapshots[kind]
@@ -0,0 +1,366 @@
+"""Utilities for exporting archived feeds
+
+Vehicle positions can be exported as a hive-partitioned Parquet dataset:
+
+/export/vehicles/service_date=20240215/route_id=51A/part-<token>-0.parquet
+
+Incremental exports record the last exported snapshot timestamp of each feed
+kind, and the snapshot range of any export in progress, in a watermark
+alongside the output:
+
+/export/vehicles/_watermark.json
+"""
+
+import itertools
+import os
+import pathlib
+import uuid
+from collections.abc import Iterable, Iterator
+from typing import TypeAlias
+
+import cloudpathlib
+import orjson
+import pendulum
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import smart_open
+
+from . import archive, model
+
+APath: TypeAlias = cloudpathlib.CloudPath | pathlib.Path
+
+# Rows per Parquet row group, large enough for efficient scans but small enough
+# that min/max statistics on vehicle_id and timestamp remain selective.
+ROW_GROUP_SIZE = 64 * 1024
+
+# Vehicle positions are converted to arrow in chunks of this many rows, so
+# exports of long date ranges are not held in memory as python objects.
+CHUNK_SIZE = 64 * 1024
+
+# Leading underscore keeps the watermark out of dataset discovery
+WATERMARK_FILENAME = "_watermark.json"
+
+# Arrow schema mirroring model.VehiclePosition
+VEHICLE_POSITION_SCHEMA = pa.schema(
+    [
+        ("entity_id", pa.string()),
+        # Trip
+        ("trip_id", pa.string()),
+        ("route_id", pa.string()),
+        ("direction_id", pa.uint32()),
+        ("start_date", pa.string()),
+        ("start_time", pa.string()),
+        ("start_datetime", pa.timestamp("s", tz="US/Pacific")),
+        ("schedule_relationship", pa.int8()),
+        # Vehicle
+        ("vehicle_id", pa.string()),
+        ("vehicle_label", pa.string()),
+        ("vehicle_license_plate", pa.string()),
+        # Position
+        ("latitude", pa.float32()),
+        ("longitude", pa.float32()),
+        ("bearing", pa.float32()),
+        ("odometer", pa.float64()),
+        ("speed", pa.float32()),
+        # ...
+        ("current_stop_sequence", pa.uint32()),
+        ("stop_id", pa.string()),
+        ("current_status", pa.int8()),
+        ("timestamp", pa.int64()),
+        ("timestamp_datetime", pa.timestamp("s", tz="UTC")),
+        ("congestion_level", pa.int8()),
+        ("occupancy_status", pa.int8()),
+        ("occupancy_percentage", pa.uint32()),
+    ]
+)
+
+# Vehicle positions datasets add the service_date partition column
+DATASET_SCHEMA = VEHICLE_POSITION_SCHEMA.append(pa.field("service_date", pa.string()))
+
+DATASET_PARTITIONING = ds.partitioning(
+    pa.schema([("service_date", pa.string()), ("route_id", pa.string())]),
+    flavor="hive",
+)
+
+
+def arrow_filesystem(path: APath) -> tuple[pafs.FileSystem, str]:
+    """Resolve a local or cloud path into a pyarrow filesystem and path."""
+    if isinstance(path, cloudpathlib.CloudPath):
+        return pafs.FileSystem.from_uri(str(path))
+
+    return pafs.LocalFileSystem(), str(path)
+
+
+def vehicle_positions_table(vehicles: Iterable[model.VehiclePosition]) -> pa.Table:
+    """Collect vehicle positions into an arrow table."""
+    names = VEHICLE_POSITION_SCHEMA.names
+    rows = [{name: getattr(vehicle, name) for name in names} for vehicle in vehicles]
+
+    return pa.Table.from_pylist(rows, schema=VEHICLE_POSITION_SCHEMA)
+
+
+def _local_dates(table: pa.Table) -> pa.Array:
+    return pc.strftime(
+        table["timestamp_datetime"].cast(pa.timestamp("s", tz="US/Pacific")),
+        format="%Y%m%d",
+    )
+
+
+def service_dates(table: pa.Table) -> pa.Array:
+    """Service date of each vehicle position as YYYYMMDD.
+
+    Uses the trip start date, falling back to the local date of the position
+    for vehicles which are not assigned to a trip.
+    """
+    return pc.coalesce(table["start_date"], _local_dates(table))
+
+
+def service_date_tables(
+    vehicles: Iterable[model.VehiclePosition],
+) -> Iterator[pa.Table]:
+    """Vehicle positions grouped into one table per service date.
+
+    Positions are read in snapshot order, and trips start at most a day
+    before their positions are reported, so each service date is complete
+    once snapshots from two local dates later are seen. A chunk's snapshot
+    time is taken as the median position timestamp, as individual vehicle
+    clocks may be skewed. Only the service dates still receiving positions
+    are held in memory.
+    """
+    pending: dict[str, list[pa.Table]] = {}
+
+    for chunk in itertools.batched(vehicles, CHUNK_SIZE):
+        table = vehicle_positions_table(chunk)
+        table = table.append_column("service_date", service_dates(table))
+
+        for service_date in pc.unique(table["service_date"]).to_pylist():
+            pending.setdefault(service_date, []).append(
+                table.filter(pc.equal(table["service_date"], service_date))
+            )
+
+        (median_timestamp,) = pc.quantile(
+            table["timestamp"], q=0.5, interpolation="lower", skip_nulls=True
+        ).to_pylist()
+        if median_timestamp is None:
+            continue
+
+        complete_before = (
+            pendulum.from_timestamp(median_timestamp, tz="US/Pacific")
+            .subtract(days=1)
+            .format("YYYYMMDD")
+        )
+
+        for service_date in sorted(pending):
+            if service_date < complete_before:
+                yield pa.concat_tables(pending.pop(service_date))
+
+    for service_date in sorted(pending):
+        yield pa.concat_tables(pending.pop(service_date))
+
+
+def write_vehicle_positions_dataset(
+    vehicles: Iterable[model.VehiclePosition],
+    output_dir: APath,
+    partition_by_route: bool = False,
+    replace_partitions: bool = False,
+    basename_token: str | None = None,
+) -> int:
+    """Write vehicle positions to a hive-partitioned Parquet dataset.
+
+    Positions are partitioned by service_date (and optionally route_id) and
+    sorted by vehicle_id and timestamp within each file. Each service date is
+    sorted and written as it completes, rather than collecting the whole range
+    in memory. By default new files are added alongside existing ones, so
+    appending new days never rewrites existing partitions. With
+    replace_partitions, any partition receiving new data is cleared first,
+    making re-exports of the same days idempotent. Files are named with
+    basename_token, or a random token if not provided.
+
+    Returns the number of rows written.
+    """
+    partition_fields = [pa.field("service_date", pa.string())]
+    if partition_by_route:
+        partition_fields.append(pa.field("route_id", pa.string()))
+
+    sort_keys = [(field.name, "ascending") for field in partition_fields] + [
+        ("vehicle_id", "ascending"),
+        ("timestamp", "ascending"),
+    ]
+
+    num_rows = 0
+
+    def batches() -> Iterator[pa.RecordBatch]:
+        nonlocal num_rows
+
+        for table in service_date_tables(vehicles):
+            num_rows += table.num_rows
+            yield from table.sort_by(sort_keys).to_batches()
+
+    filesystem, base_dir = arrow_filesystem(output_dir)
+
+    ds.write_dataset(
+        batches(),
+        base_dir,
+        schema=DATASET_SCHEMA,
+        filesystem=filesystem,
+        format="parquet",
+        # Threaded writes do not preserve the sort order within files
+        use_threads=False,
+        partitioning=ds.partitioning(pa.schema(partition_fields), flavor="hive"),
+        basename_template=f"part-{basename_token or uuid.uuid4().hex}-{{i}}.parquet",
+        min_rows_per_group=ROW_GROUP_SIZE,
+        max_rows_per_group=ROW_GROUP_SIZE,
+        existing_data_behavior=(
+            "delete_matching" if replace_partitions else "overwrite_or_ignore"
+        ),
+    )
+
+    return num_rows
+
+
+def open_vehicle_positions_dataset(dataset_dir: APath) -> ds.Dataset:
+    """Open a vehicle positions dataset, with or without route partitions."""
+    filesystem, base_dir = arrow_filesystem(dataset_dir)
+
+    return ds.dataset(
+        base_dir,
+        filesystem=filesystem,
+        format="parquet",
+        schema=DATASET_SCHEMA,
+        partitioning=DATASET_PARTITIONING,
+    )
+
+
+def _read_watermark_file(output_dir: APath) -> dict:
+    watermark_path = output_dir / WATERMARK_FILENAME
+
+    if not watermark_path.exists():
+        return {"watermarks": {}, "pending": {}}
+
+    with smart_open.open(str(watermark_path), "rb") as fin:
+        return orjson.loads(fin.read())
+
+
+def _write_watermark_file(output_dir: APath, state: dict) -> None:
+    """Write the watermark file.
+
+    Local watermarks are written to a temporary file and renamed into place.
+    Cloud objects only become visible once fully uploaded, so are written
+    directly.
+    """
+    watermark_bytes = orjson.dumps(state, option=orjson.OPT_SORT_KEYS)
+
+    watermark_path = output_dir / WATERMARK_FILENAME
+
+    if isinstance(watermark_path, cloudpathlib.CloudPath):
+        watermark_path.write_bytes(watermark_bytes)
+        return
+
+    watermark_path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = watermark_path.with_name(f".{WATERMARK_FILENAME}.{uuid.uuid4().hex}")
+    with open(tmp_path, "wb") as fout:
+        fout.write(watermark_bytes)
+        fout.flush()
+        os.fsync(fout.fileno())
+
+    os.replace(tmp_path, watermark_path)
+
+
+def read_watermarks(output_dir: APath) -> dict[str, int]:
+    """Read the last exported snapshot timestamp of each feed kind."""
+    return _read_watermark_file(output_dir)["watermarks"]
+
+
+def read_pending_range(output_dir: APath, kind: str) -> tuple[int | None, int] | None:
+    """Read the snapshot range of an export of a feed kind which has not been
+    committed, if any.
+    """
+    pending = _read_watermark_file(output_dir)["pending"].get(kind)
+
+    if pending is None:
+        return None
+
+    after, until = pending
+    return after, until
+
+
+def write_pending_range(
+    output_dir: APath, kind: str, after: int | None, until: int
+) -> None:
+    """Record the snapshot range of a feed kind about to be exported."""
+    state = _read_watermark_file(output_dir)
+    state["pending"][kind] = [after, until]
+
+    _write_watermark_file(output_dir, state)
+
+
+def write_watermark(output_dir: APath, kind: str, timestamp: int) -> None:
+    """Commit the last exported snapshot timestamp of a feed kind, clearing
+    its pending range.
+    """
+    state = _read_watermark_file(output_dir)
+    state["watermarks"][kind] = timestamp
+    state["pending"].pop(kind, None)
+
+    _write_watermark_file(output_dir, state)
+
+
+def export_vehicle_positions_incremental(
+    input_dir: APath,
+    output_dir: APath,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    filter: dict[str, str] | None = None,
+    partition_by_route: bool = False,
+) -> tuple[int, int | None]:
+    """Append vehicle positions newer than the watermark to a dataset.
+
+    Only snapshots newer than the vehicles watermark are read. Once there is a
+    watermark, days are scanned from the day of the watermark rather than from
+    start, so snapshots archived late on a day are not skipped by a run on the
+    next. The range of snapshots to export is recorded as pending before any
+    dataset files are written, and the watermark is advanced to the end of the
+    range once they have been. A crashed run leaves the range pending, and the
+    retry exports exactly the same range, whatever its start and end, even if
+    newer snapshots have since been archived. Files are named after the range,
+    so the retry overwrites any partial output.
+
+    Returns the number of rows written and the new watermark.
+    """
+    pending = read_pending_range(output_dir, "vehicles")
+    after = pending[0] if pending else read_watermarks(output_dir).get("vehicles")
+
+    if after is not None:
+        start = pendulum.from_timestamp(after)
+
+    if pending is not None:
+        until = pending[1]
+        end = pendulum.from_timestamp(until)
+
+    else:
+        archived_feeds = list(
+            archive.list_archived_feeds("vehicles", input_dir, start, end, after)
+        )
+        if not archived_feeds:
+            return 0, after
+
+        until = archived_feeds[-1].timestamp
+
+        write_pending_range(output_dir, "vehicles", after, until)
+
+    vehicles = archive.retrieve_vehicle_positions(
+        input_dir, start, end, filter, after=after, until=until
+    )
+    num_rows = write_vehicle_positions_dataset(
+        vehicles,
+        output_dir,
+        partition_by_route=partition_by_route,
+        basename_token=f"{after or 0}-{until}",
+    )
+
+    write_watermark(output_dir, "vehicles", until)
+
+    return num_rows, until
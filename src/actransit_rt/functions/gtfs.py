@@ -1,9 +1,12 @@
 """Libraries for retrieving and processing GTFS"""
 
+import os
+
 import requests
 from google.transit import gtfs_realtime_pb2
 
-BASE_URL = "https://api.actransit.org/transit"
+# Override to point at another server, such as `actransit-rt replay`
+BASE_URL = os.environ.get("ACTRANSIT_BASE_URL", "https://api.actransit.org/transit")
 
 
 def retrieve_tripupdates_feed(token: str) -> gtfs_realtime_pb2.FeedMessage:
@@ -0,0 +1,157 @@
+"""Observed stop arrivals and headways from vehicle positions
+
+Arrivals are detected from changes to each vehicle's current stop and status
+using vectorized group-by and shift operations over column batches of
+positions, such as one service date of an exported vehicle positions dataset.
+
+A vehicle arrives at a stop when it is first reported STOPPED_AT the stop. If
+it was never reported stopped there, the stop was passed by the time the
+vehicle was first reported heading to a later stop.
+"""
+
+import pathlib
+from collections.abc import Iterator
+from typing import TypeAlias
+
+import cloudpathlib
+import numpy as np
+import pandas as pd
+import pendulum
+import pyarrow.dataset as ds
+
+from . import export, model
+
+APath: TypeAlias = cloudpathlib.CloudPath | pathlib.Path
+
+# Columns of vehicle positions used to detect arrivals
+POSITION_COLUMNS = [
+    "route_id",
+    "direction_id",
+    "trip_id",
+    "start_date",
+    "vehicle_id",
+    "current_stop_sequence",
+    "stop_id",
+    "current_status",
+    "timestamp",
+]
+
+# A vehicle serving a trip instance
+TRIP_KEYS = ["vehicle_id", "trip_id", "start_date"]
+
+ARRIVAL_COLUMNS = [
+    "route_id",
+    "direction_id",
+    "trip_id",
+    "start_date",
+    "vehicle_id",
+    "current_stop_sequence",
+    "stop_id",
+    "arrival_timestamp",
+    "arrival_type",
+]
+
+# Headways are measured between consecutive arrivals at the same route stop
+HEADWAY_KEYS = ["route_id", "direction_id", "stop_id"]
+
+
+def read_position_batches(
+    dataset_dir: APath, start_date: pendulum.Date, end_date: pendulum.Date
+) -> Iterator[pd.DataFrame]:
+    """Read one service date at a time from a vehicle positions dataset."""
+    dataset = export.open_vehicle_positions_dataset(dataset_dir)
+
+    num_days = end_date.diff(start_date).in_days()
+
+    for i in range(num_days + 1):
+        service_date = start_date.add(days=i).strftime("%Y%m%d")
+
+        table = dataset.to_table(
+            columns=POSITION_COLUMNS, filter=ds.field("service_date") == service_date
+        )
+
+        if table.num_rows:
+            yield table.to_pandas().astype({"direction_id": "Int64"})
+
+
+def arrival_events(positions: pd.DataFrame) -> pd.DataFrame:
+    """Stop arrivals of each trip observed in a batch of vehicle positions."""
+    positions = positions[POSITION_COLUMNS].dropna(
+        subset=["trip_id", "start_date", "current_stop_sequence", "stop_id"]
+    )
+
+    # A vehicle's last report repeats in each snapshot until it reports again
+    positions = positions.drop_duplicates(["vehicle_id", "timestamp"])
+    positions = positions.sort_values(TRIP_KEYS + ["timestamp"])
+
+    # Keep only the positions where the vehicle's stop or status changed
+    state = ["current_stop_sequence", "stop_id", "current_status"]
+    previous = positions.groupby(TRIP_KEYS, sort=False)[state].shift()
+    transitions = positions[(positions[state] != previous).any(axis=1)]
+
+    is_stopped = transitions["current_status"] == model.VehicleStopStatus.STOPPED_AT
+
+    stops = (
+        transitions.assign(stopped_timestamp=transitions["timestamp"].where(is_stopped))
+        .groupby(TRIP_KEYS + ["current_stop_sequence", "stop_id"], sort=False)
+        .agg(
+            route_id=("route_id", "first"),
+            direction_id=("direction_id", "first"),
+            first_timestamp=("timestamp", "min"),
+            stopped_timestamp=("stopped_timestamp", "min"),
+        )
+        .reset_index()
+        .sort_values(TRIP_KEYS + ["current_stop_sequence"])
+    )
+
+    # When the vehicle was first reported heading to a later stop of the trip
+    following = stops.groupby(TRIP_KEYS, sort=False)[
+        ["current_stop_sequence", "first_timestamp"]
+    ].shift(-1)
+    passed_timestamp = following["first_timestamp"].where(
+        following["current_stop_sequence"] > stops["current_stop_sequence"]
+    )
+
+    arrivals = stops.assign(
+        arrival_timestamp=stops["stopped_timestamp"].fillna(passed_timestamp),
+        arrival_type=np.where(stops["stopped_timestamp"].notna(), "stopped", "passed"),
+    ).dropna(subset=["arrival_timestamp"])
+
+    return (
+        arrivals[ARRIVAL_COLUMNS]
+        .astype({"current_stop_sequence": "int64", "arrival_timestamp": "int64"})
+        .reset_index(drop=True)
+    )
+
+
+def headways(arrivals: pd.DataFrame) -> pd.DataFrame:
+    """Time since the previous arrival at the same route stop on the same day."""
+    arrivals = arrivals.sort_values(HEADWAY_KEYS + ["start_date", "arrival_timestamp"])
+
+    headway_seconds = arrivals.groupby(
+        HEADWAY_KEYS + ["start_date"], sort=False, dropna=False
+    )["arrival_timestamp"].diff()
+
+    return (
+        arrivals.assign(headway_seconds=headway_seconds)
+        .dropna(subset=["headway_seconds"])
+        .astype({"headway_seconds": "int64"})
+        .reset_index(drop=True)
+    )
+
+
+def headway_summary(headways: pd.DataFrame) -> pd.DataFrame:
+    """Distribution of headways at each route stop."""
+    grouped = headways.groupby(HEADWAY_KEYS, dropna=False)["headway_seconds"]
+
+    quantiles = (
+        grouped.quantile([0.1, 0.5, 0.9])
+        .unstack()
+        .reindex(columns=[0.1, 0.5, 0.9])
+        .set_axis(["p10", "median", "p90"], axis="columns")
+    )
+
+    summary = grouped.agg(["count", "mean", "std"]).join(quantiles)
+    summary["cv"] = summary["std"] / summary["mean"]
+
+    return summary.reset_index()
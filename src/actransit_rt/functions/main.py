@@ -4,7 +4,10 @@ import cloudpathlib
 import flask
 import functions_framework
 
-from . import archive
+from . import archive, cache, server
+
+# Kept across requests served by the same function instance
+_latest_feed_cache: cache.LatestFeedCache | None = None
 
 
 @functions_framework.http
@@ -41,3 +44,29 @@ def snapshot_feeds(request: flask.Request) -> flask.typing.ResponseReturnValue:
     )
 
     return "Success"
+
+
+@functions_framework.http
+def latest_feed(request: flask.Request) -> flask.typing.ResponseReturnValue:
+    global _latest_feed_cache
+
+    if _latest_feed_cache is None:
+        api_token = os.environ.get("ACTRANSIT_API_TOKEN")
+        if not api_token:
+            print("Must configure a valid ACTRANSIT_API_TOKEN")
+            return "Bad config"
+
+        _latest_feed_cache = cache.LatestFeedCache(api_token)
+
+    path = request.path.rstrip("/")
+
+    if path == "/vehicles.json":
+        return server.vehicles_json_response(
+            request, _latest_feed_cache.get_snapshot("vehicles")
+        )
+
+    kind = path.removeprefix("/gtfsrt/")
+    if kind not in server.FEED_KINDS:
+        return "Not found", 404
+
+    return server.feed_response(request, _latest_feed_cache.get_snapshot(kind))
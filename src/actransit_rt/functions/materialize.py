@@ -0,0 +1,242 @@
+"""Local Arrow IPC cache of decoded vehicle positions
+
+Each UTC day of archived vehicle positions is decoded once into an
+uncompressed Arrow IPC (Feather v2) file, which is memory-mapped for
+zero-copy reads:
+
+/cache/vehicles/2024/02/15/20240215.vehicles.arrow
+
+Each file records in its schema metadata when it was materialized and the
+timestamp of the last snapshot it covers. Days materialized before they could
+have been fully archived are checked against the archive when read, so they
+are recognised as stale once newer snapshots arrive. Other days are read from
+the cache alone.
+"""
+
+import itertools
+import os
+import pathlib
+import uuid
+from collections.abc import Iterator
+from typing import TypeAlias
+
+import cloudpathlib
+import pendulum
+import pyarrow as pa
+
+from . import archive, export, model
+
+APath: TypeAlias = cloudpathlib.CloudPath | pathlib.Path
+
+LAST_SNAPSHOT_KEY = b"last_snapshot_timestamp"
+MATERIALIZED_AT_KEY = b"materialized_at"
+
+# Snapshots of a UTC day are assumed to be archived within this long of its end
+ARCHIVE_DELAY = pendulum.duration(days=1)
+
+
+def _utc_days(
+    start: pendulum.DateTime, end: pendulum.DateTime
+) -> Iterator[pendulum.Date]:
+    start_date = start.in_tz("UTC").date()
+    end_date = end.in_tz("UTC").date()
+
+    num_days = end_date.diff(start_date).in_days()
+
+    for i in range(num_days + 1):
+        yield start_date.add(days=i)
+
+
+def _utc_day_start(day: pendulum.Date) -> pendulum.DateTime:
+    return pendulum.datetime(day.year, day.month, day.day, tz="UTC")
+
+
+def cache_path(cache_dir: pathlib.Path, day: pendulum.Date) -> pathlib.Path:
+    path = archive.base_path("vehicles", cache_dir, day)
+    return pathlib.Path(path) / f"{day.strftime('%Y%m%d')}.vehicles.arrow"
+
+
+def materialize_vehicle_positions(
+    input_dir: APath,
+    cache_dir: pathlib.Path,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+) -> Iterator[tuple[pathlib.Path, int]]:
+    """Decode each day of archived vehicle positions into the cache.
+
+    Files are written to a temporary name and renamed into place, so readers
+    never see a partially written day. Positions are converted in chunks, so a
+    day is never held in memory as python objects. Days without snapshots are
+    skipped. Each file records when it was materialized and the last snapshot
+    it covers. Yields each written path and its number of rows.
+    """
+    for day in _utc_days(start, end):
+        day_start = _utc_day_start(day)
+
+        archived_feeds = list(
+            archive.list_archived_feeds("vehicles", input_dir, day_start, day_start)
+        )
+        if not archived_feeds:
+            continue
+
+        until = archived_feeds[-1].timestamp
+
+        vehicles = archive.retrieve_vehicle_positions(
+            input_dir, day_start, day_start, until=until
+        )
+        schema = export.VEHICLE_POSITION_SCHEMA.with_metadata(
+            {
+                LAST_SNAPSHOT_KEY: str(until).encode(),
+                MATERIALIZED_AT_KEY: str(pendulum.now().int_timestamp).encode(),
+            }
+        )
+
+        output = cache_path(cache_dir, day)
+        output.parent.mkdir(parents=True, exist_ok=True)
+
+        num_rows = 0
+
+        tmp_output = output.with_name(f".{output.name}.{uuid.uuid4().hex}")
+        with pa.OSFile(str(tmp_output), "wb") as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                for chunk in itertools.batched(vehicles, export.CHUNK_SIZE):
+                    table = export.vehicle_positions_table(chunk)
+                    for batch in table.to_batches():
+                        writer.write_batch(batch)
+
+                    num_rows += table.num_rows
+
+        os.replace(tmp_output, output)
+
+        yield output, num_rows
+
+
+def read_cached_day(path: pathlib.Path) -> pa.Table:
+    """Memory-map a cached day, without copying it into memory."""
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _cache_metadata(path: pathlib.Path) -> dict[bytes, bytes]:
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_file(source).schema.metadata or {}
+
+
+def cached_until(path: pathlib.Path) -> int | None:
+    """Timestamp of the last snapshot covered by a cached day."""
+    last_snapshot = _cache_metadata(path).get(LAST_SNAPSHOT_KEY)
+    return int(last_snapshot) if last_snapshot is not None else None
+
+
+def is_cache_current(
+    input_dir: APath | None, path: pathlib.Path, day: pendulum.Date
+) -> bool:
+    """Whether a cached day covers every snapshot archived for it.
+
+    Without an archive to compare against, cached days are trusted. Days
+    materialized at least ARCHIVE_DELAY after they ended are trusted without
+    listing the archive, while earlier ones are current only if no snapshots
+    have been archived since.
+    """
+    if not path.exists():
+        return False
+
+    if input_dir is None:
+        return True
+
+    metadata = _cache_metadata(path)
+
+    # Caches without materialized_at were written at or after their last snapshot
+    materialized_at = metadata.get(MATERIALIZED_AT_KEY, metadata.get(LAST_SNAPSHOT_KEY))
+    if materialized_at is None:
+        return False
+
+    day_start = _utc_day_start(day)
+    settled_at = day_start.add(days=1) + ARCHIVE_DELAY
+    if int(materialized_at) >= settled_at.int_timestamp:
+        return True
+
+    until = metadata.get(LAST_SNAPSHOT_KEY)
+    if until is None:
+        return False
+
+    newer_feeds = archive.list_archived_feeds(
+        "vehicles", input_dir, day_start, day_start, after=int(until)
+    )
+
+    return next(newer_feeds, None) is None
+
+
+def read_vehicle_positions_cache(
+    cache_dir: pathlib.Path,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    input_dir: APath | None = None,
+) -> pa.Table:
+    """Memory-map the cached days spanned by start and end into one table.
+
+    With input_dir, stale or missing days are decoded from the archive instead.
+    """
+    tables = []
+
+    for day in _utc_days(start, end):
+        path = cache_path(cache_dir, day)
+
+        if is_cache_current(input_dir, path, day):
+            tables.append(read_cached_day(path))
+
+        elif input_dir is not None:
+            day_start = _utc_day_start(day)
+            vehicles = archive.retrieve_vehicle_positions(
+                input_dir, day_start, day_start
+            )
+            tables.append(export.vehicle_positions_table(vehicles))
+
+    if not tables:
+        return export.VEHICLE_POSITION_SCHEMA.empty_table()
+
+    return pa.concat_tables(tables)
+
+
+def retrieve_vehicle_positions(
+    input_dir: APath | None,
+    cache_dir: pathlib.Path,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    filter: dict[str, str] | None = None,
+    limit: int | None = None,
+) -> Iterator[model.VehiclePosition]:
+    """Retrieve vehicle positions, preferring cached days to the archive.
+
+    Stale or missing days are decoded from the archive instead, unless there
+    is no input_dir, in which case only cached days are read.
+    """
+    num_records = 0
+
+    for day in _utc_days(start, end):
+        path = cache_path(cache_dir, day)
+
+        if is_cache_current(input_dir, path, day):
+            vehicles: Iterator[model.VehiclePosition] = (
+                model.VehiclePosition.from_dict(row)
+                for batch in read_cached_day(path).to_batches()
+                for row in batch.to_pylist()
+            )
+        elif input_dir is not None:
+            day_start = _utc_day_start(day)
+            vehicles = archive.retrieve_vehicle_positions(
+                input_dir, day_start, day_start
+            )
+        else:
+            continue
+
+        for vehicle in vehicles:
+            if limit and num_records >= limit:
+                return
+
+            if filter and not archive.matches_filter(vehicle, filter):
+                continue
+
+            yield vehicle
+
+            num_records += 1
@@ -5,6 +5,9 @@ https:#github.com/MobilityData/gtfs-realtime-bindings/blob/master/gtfs-realtime.
 import dataclasses
 import datetime
 import enum
+import functools
+import sys
+from typing import Any
 
 import pytz
 from google.transit import gtfs_realtime_pb2
@@ -96,6 +99,17 @@ class VehicleOccupancyStatus(enum.IntEnum):
     NOT_BOARDABLE = 8
 
 
+PACIFIC_TZ = pytz.timezone("US/Pacific")
+
+# VehiclePosition fields holding enums
+_ENUM_FIELDS: dict[str, type[enum.IntEnum]] = {
+    "schedule_relationship": TripScheduleRelationship,
+    "current_status": VehicleStopStatus,
+    "congestion_level": VehicleCongestionLevel,
+    "occupancy_status": VehicleOccupancyStatus,
+}
+
+
 def _parse_gtfs_datetime(
     gtfs_date: str, gtfs_time: str, tz: pytz.tzinfo.BaseTzInfo | None = None
 ) -> datetime.datetime:
@@ -105,15 +119,26 @@ def _parse_gtfs_datetime(
         hours=hours, minutes=minutes, seconds=seconds
     )
 
+    # pytz zones must be attached with localize, replace gives local mean time
     if tz is not None:
-        dt = dt.replace(tzinfo=tz)
+        dt = tz.localize(dt)
 
     return dt
 
 
-@dataclasses.dataclass(frozen=True, kw_only=True)
+@functools.lru_cache(maxsize=4096)
+def _parse_start_datetime(start_date: str, start_time: str) -> datetime.datetime:
+    """Memoized trip start datetime, as start dates and times repeat across rows"""
+    return _parse_gtfs_datetime(start_date, start_time, tz=PACIFIC_TZ)
+
+
+@dataclasses.dataclass(frozen=True, kw_only=True, slots=True)
 class VehiclePosition:
-    """Data for a GFTS-RT vehicle"""
+    """Data for a GFTS-RT vehicle
+
+    Datetimes are derived on access from the compact start_date, start_time and
+    timestamp fields rather than stored per row.
+    """
 
     entity_id: str
 
@@ -124,7 +149,6 @@ class VehiclePosition:
     direction_id: int | None = None
     start_date: str | None = None
     start_time: str | None = None
-    start_datetime: datetime.datetime | None = None
     schedule_relationship: TripScheduleRelationship | None = None
 
     #  Additional information on the vehicle that is serving this trip.
@@ -150,7 +174,6 @@ class VehiclePosition:
 
     # Moment at which the vehicle's position was measured.
     timestamp: int
-    timestamp_datetime: datetime.datetime
 
     # Congestion level that is affecting this vehicle.
     congestion_level: VehicleCongestionLevel | None = None
@@ -165,6 +188,47 @@ class VehiclePosition:
     # including both seated and standing capacity, and current operating regulations allow.
     occupancy_percentage: int | None = None
 
+    @property
+    def start_datetime(self) -> datetime.datetime | None:
+        if self.start_date is None or self.start_time is None:
+            return None
+
+        return _parse_start_datetime(self.start_date, self.start_time)
+
+    @property
+    def timestamp_datetime(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.timestamp, tz=datetime.UTC)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Fields and derived datetimes, in declaration order"""
+        row: dict[str, Any] = {}
+
+        for field in dataclasses.fields(self):
+            row[field.name] = getattr(self, field.name)
+
+            if field.name == "start_time":
+                row["start_datetime"] = self.start_datetime
+
+            elif field.name == "timestamp":
+                row["timestamp_datetime"] = self.timestamp_datetime
+
+        return row
+
+    @classmethod
+    def from_dict(cls, row: dict[str, Any]) -> "VehiclePosition":
+        """Create a VehiclePosition from to_dict output, ignoring derived datetimes"""
+        values = {
+            field.name: row[field.name]
+            for field in dataclasses.fields(cls)
+            if field.name in row
+        }
+
+        for name, enum_type in _ENUM_FIELDS.items():
+            if values.get(name) is not None:
+                values[name] = enum_type(values[name])
+
+        return cls(**values)
+
     @classmethod
     def from_feed(cls, entity: gtfs_realtime_pb2.FeedEntity) -> "VehiclePosition":
         """Create a VehiclePosition from a feed VehiclePosition"""
@@ -186,9 +250,16 @@ class VehiclePosition:
         return VehiclePosition(
             entity_id=entity.id,
             # Trip
-            trip_id=vehicle.trip.trip_id if vehicle.trip.HasField("trip_id") else None,
+            # Identifiers repeat across rows, so are interned to share storage
+            trip_id=(
+                sys.intern(vehicle.trip.trip_id)
+                if vehicle.trip.HasField("trip_id")
+                else None
+            ),
             route_id=(
-                vehicle.trip.route_id if vehicle.trip.HasField("route_id") else None
+                sys.intern(vehicle.trip.route_id)
+                if vehicle.trip.HasField("route_id")
+                else None
             ),
             direction_id=(
                 vehicle.trip.direction_id
@@ -196,30 +267,24 @@ class VehiclePosition:
                 else None
             ),
             start_date=(
-                vehicle.trip.start_date if vehicle.trip.HasField("start_date") else None
+                sys.intern(vehicle.trip.start_date)
+                if vehicle.trip.HasField("start_date")
+                else None
             ),
             start_time=(
-                vehicle.trip.start_time if vehicle.trip.HasField("start_time") else None
-            ),
-            start_datetime=(
-                _parse_gtfs_datetime(
-                    vehicle.trip.start_date,
-                    vehicle.trip.start_time,
-                    tz=pytz.timezone("US/Pacific"),
-                )
-                if (
-                    vehicle.trip.HasField("start_date")
-                    and vehicle.trip.HasField("start_time")
-                )
+                sys.intern(vehicle.trip.start_time)
+                if vehicle.trip.HasField("start_time")
                 else None
             ),
             schedule_relationship=TripScheduleRelationship(
                 vehicle.trip.schedule_relationship
             ),
             # Vehicle
-            vehicle_id=vehicle.vehicle.id,
+            vehicle_id=sys.intern(vehicle.vehicle.id),
             vehicle_label=(
-                vehicle.vehicle.label if vehicle.vehicle.HasField("label") else None
+                sys.intern(vehicle.vehicle.label)
+                if vehicle.vehicle.HasField("label")
+                else None
             ),
             vehicle_license_plate=(
                 vehicle.vehicle.license_plate
@@ -248,16 +313,15 @@ class VehiclePosition:
                 if vehicle.HasField("current_stop_sequence")
                 else None
             ),
-            stop_id=vehicle.stop_id if vehicle.HasField("stop_id") else None,
+            stop_id=(
+                sys.intern(vehicle.stop_id) if vehicle.HasField("stop_id") else None
+            ),
             current_status=(
                 VehicleStopStatus(vehicle.current_status)
                 if vehicle.HasField("current_status")
                 else None
             ),
             timestamp=vehicle.timestamp,
-            timestamp_datetime=datetime.datetime.fromtimestamp(
-                vehicle.timestamp, tz=datetime.UTC
-            ),
             congestion_level=(
                 VehicleCongestionLevel(vehicle.congestion_level)
                 if vehicle.HasField("congestion_level")
@@ -0,0 +1,101 @@
+"""Replay archived feeds as a live GTFS-RT feed
+
+Snapshots of every feed kind are played back in timestamp order, either in
+real time, accelerated by a speed factor, or as fast as they can be read.
+"""
+
+import pathlib
+import threading
+import time
+from collections.abc import Iterator
+from typing import TypeAlias
+
+import cloudpathlib
+import pendulum
+from google.transit import gtfs_realtime_pb2
+
+from . import archive, server
+
+APath: TypeAlias = cloudpathlib.CloudPath | pathlib.Path
+
+
+class Replayer:
+    """Plays back archived snapshots, tracking the current snapshot of each kind.
+
+    A speed of 1.0 replays in real time, 10.0 replays ten times faster, and 0
+    replays as fast as snapshots can be read.
+    """
+
+    def __init__(
+        self,
+        base_dir: APath,
+        start: pendulum.DateTime,
+        end: pendulum.DateTime,
+        speed: float = 1.0,
+        loop: bool = False,
+    ) -> None:
+        if speed < 0:
+            raise ValueError("Speed must not be negative")
+
+        self.base_dir = base_dir
+        self.start = start
+        self.end = end
+        self.speed = speed
+        self.loop = loop
+
+        self._snapshots: dict[str, server.FeedSnapshot] = {}
+        self._stopped = threading.Event()
+
+    def get_snapshot(self, kind: str) -> server.FeedSnapshot | None:
+        return self._snapshots.get(kind)
+
+    def feeds(self) -> Iterator[tuple[str, gtfs_realtime_pb2.FeedMessage]]:
+        """Archived feeds of every kind, merged by snapshot timestamp."""
+        for frame in archive.retrieve_feed_frames(self.base_dir, self.start, self.end):
+            feed = getattr(frame, frame.kind)
+            yield frame.kind, feed
+
+    def run(self) -> None:
+        """Play back snapshots until exhausted, or forever when looping.
+
+        Looping stops if a pass finds no snapshots to play back.
+        """
+        while not self._stopped.is_set():
+            if not self._play():
+                print(f"No snapshots to replay in {self.base_dir}")
+                break
+
+            if not self.loop:
+                break
+
+    def _play(self) -> bool:
+        """Play back one pass of snapshots, returning whether any were found."""
+        wall_start = time.monotonic()
+        feed_start: int | None = None
+
+        for kind, feed in self.feeds():
+            timestamp = int(feed.header.timestamp)
+
+            if feed_start is None:
+                feed_start = timestamp
+
+            if self.speed:
+                delay = wall_start + (timestamp - feed_start) / self.speed
+                if self._stopped.wait(max(delay - time.monotonic(), 0)):
+                    break
+
+            elif self._stopped.is_set():
+                break
+
+            self._snapshots[kind] = server.FeedSnapshot.from_feed(kind, feed)
+
+        return feed_start is not None
+
+    def start_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name="replay", daemon=True)
+        thread.start()
+
+        return thread
+
+    def stop(self) -> None:
+        self._stopped.set()
@@ -0,0 +1,125 @@
+"""Utilities for serving GTFS-RT feeds over HTTP
+
+Feeds are served at the same paths as the AC Transit API:
+
+/gtfsrt/tripupdates
+/gtfsrt/vehicles
+/gtfsrt/alerts
+
+Vehicle positions are also served as JSON, optionally filtered by route:
+
+/vehicles.json?route_id=51A&route_id=NL
+"""
+
+import dataclasses
+import datetime
+import functools
+from collections.abc import Callable
+from typing import TypeAlias
+
+import flask
+import orjson
+from google.transit import gtfs_realtime_pb2
+
+from . import model
+
+FEED_KINDS = ("tripupdates", "vehicles", "alerts")
+
+
+@dataclasses.dataclass(frozen=True)
+class FeedSnapshot:
+    """A feed alongside its serialized bytes, serialized once for all clients"""
+
+    kind: str
+    feed: gtfs_realtime_pb2.FeedMessage
+    content: bytes
+
+    @classmethod
+    def from_feed(
+        cls, kind: str, feed: gtfs_realtime_pb2.FeedMessage
+    ) -> "FeedSnapshot":
+        return cls(kind=kind, feed=feed, content=feed.SerializeToString())
+
+    @property
+    def timestamp(self) -> int:
+        return int(self.feed.header.timestamp)
+
+    @property
+    def etag(self) -> str:
+        return f"{self.kind}-{self.timestamp}"
+
+    @functools.cached_property
+    def vehicle_positions(self) -> list[model.VehiclePosition]:
+        """Decoded vehicle positions, skipping entities without a position"""
+        vehicles = []
+
+        for entity in self.feed.entity:
+            try:
+                vehicles.append(model.VehiclePosition.from_feed(entity))
+            except ValueError:
+                continue
+
+        return vehicles
+
+
+# Returns the current snapshot of a feed kind, if any
+SnapshotSource: TypeAlias = Callable[[str], FeedSnapshot | None]
+
+
+def _conditional_response(
+    request: flask.Request, snapshot: FeedSnapshot, response: flask.Response
+) -> flask.Response:
+    """Tag a response with its snapshot, answering 304 when the client is current"""
+    response.set_etag(snapshot.etag)
+    response.last_modified = datetime.datetime.fromtimestamp(
+        snapshot.timestamp, tz=datetime.UTC
+    )
+    response.cache_control.no_cache = True
+    response.make_conditional(request)
+
+    return response
+
+
+def feed_response(
+    request: flask.Request, snapshot: FeedSnapshot | None
+) -> flask.Response:
+    if snapshot is None:
+        return flask.Response("Feed not yet available", status=503)
+
+    response = flask.Response(snapshot.content, mimetype="application/x-protobuf")
+
+    return _conditional_response(request, snapshot, response)
+
+
+def vehicles_json_response(
+    request: flask.Request, snapshot: FeedSnapshot | None
+) -> flask.Response:
+    if snapshot is None:
+        return flask.Response("Feed not yet available", status=503)
+
+    vehicles = snapshot.vehicle_positions
+
+    route_ids = set(request.args.getlist("route_id"))
+    if route_ids:
+        vehicles = [vehicle for vehicle in vehicles if vehicle.route_id in route_ids]
+
+    response = flask.Response(
+        orjson.dumps([vehicle.to_dict() for vehicle in vehicles]),
+        mimetype="application/json",
+    )
+
+    return _conditional_response(request, snapshot, response)
+
+
+def create_app(source: SnapshotSource) -> flask.Flask:
+    app = flask.Flask(__name__)
+
+    @app.get("/gtfsrt/<any(tripupdates, vehicles, alerts):kind>")
+    def gtfsrt(kind: str) -> flask.Response:
+        return feed_response(flask.request, source(kind))
+
+    @app.get("/vehicles.json")
+    def vehicles_json() -> flask.Response:
+        return vehicles_json_response(flask.request, source("vehicles"))
+
+    return app
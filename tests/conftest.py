@@ -0,0 +1,64 @@
+import pathlib
+
+import pytest
+import smart_open
+from google.transit import gtfs_realtime_pb2
+
+from actransit_rt.functions import archive
+
+# 2024-02-15 10:00:00 US/Pacific
+START_TIMESTAMP = 1708020000
+
+
+def make_feed(kind: str, timestamp: int) -> gtfs_realtime_pb2.FeedMessage:
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = timestamp
+
+    if kind == "vehicles":
+        for i, route_id in enumerate(["51A", "NL"]):
+            entity = feed.entity.add(id=f"{timestamp}-{i}")
+            entity.vehicle.trip.trip_id = f"trip-{route_id}"
+            entity.vehicle.trip.route_id = route_id
+            entity.vehicle.trip.start_date = "20240215"
+            entity.vehicle.trip.start_time = "09:55:00"
+            entity.vehicle.vehicle.id = f"vehicle-{route_id}"
+            entity.vehicle.position.latitude = 37.8
+            entity.vehicle.position.longitude = -122.27
+            entity.vehicle.current_stop_sequence = (timestamp - START_TIMESTAMP) // 60
+            entity.vehicle.stop_id = f"stop-{entity.vehicle.current_stop_sequence}"
+            entity.vehicle.current_status = gtfs_realtime_pb2.VehiclePosition.STOPPED_AT
+            entity.vehicle.timestamp = timestamp
+
+    elif kind == "tripupdates":
+        entity = feed.entity.add(id=f"{timestamp}-0")
+        entity.trip_update.trip.trip_id = "trip-51A"
+        update = entity.trip_update.stop_time_update.add()
+        update.stop_sequence = (timestamp - START_TIMESTAMP) // 60
+        update.arrival.time = timestamp + 30
+
+    elif kind == "alerts":
+        entity = feed.entity.add(id=f"{timestamp}-0")
+        entity.alert.header_text.translation.add(text="Detour")
+
+    return feed
+
+
+def write_feed(base_dir: pathlib.Path, kind: str, timestamp: int) -> None:
+    output = archive.output_path(kind, base_dir, timestamp)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    with smart_open.open(str(output), "wb") as fout:
+        fout.write(make_feed(kind, timestamp).SerializeToString())
+
+
+@pytest.fixture
+def archive_dir(tmp_path: pathlib.Path) -> pathlib.Path:
+    """An archive of five per-minute snapshots of each feed kind."""
+    base_dir = tmp_path / "archive"
+
+    for i in range(5):
+        for kind in ["tripupdates", "vehicles", "alerts"]:
+            write_feed(base_dir, kind, START_TIMESTAMP + 60 * i)
+
+    return base_dir
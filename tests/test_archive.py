@@ -0,0 +1,104 @@
+import pathlib
+
+import pendulum
+import pytest
+
+from actransit_rt.functions import archive
+
+from .conftest import START_TIMESTAMP, make_feed
+
+START = pendulum.datetime(2024, 2, 15, tz="America/Los_Angeles")
+END = START.end_of("day")
+
+
+def test_retrieve_feed_frames(archive_dir: pathlib.Path) -> None:
+    frames = list(archive.retrieve_feed_frames(archive_dir, START, END))
+    assert len(frames) == 15
+
+    timestamps = [frame.timestamp for frame in frames]
+    assert timestamps == sorted(timestamps)
+
+    # Snapshots at the same time are ordered by kind
+    assert [frame.kind for frame in frames[:3]] == ["alerts", "tripupdates", "vehicles"]
+    assert frames[0].tripupdates is None
+
+    for frame in frames:
+        feed = getattr(frame, frame.kind)
+        assert feed.header.timestamp == frame.timestamp
+
+
+def test_join_stop_time_updates(archive_dir: pathlib.Path) -> None:
+    frames = archive.retrieve_feed_frames(archive_dir, START, END)
+    joined = list(archive.join_stop_time_updates(frames))
+    assert len(joined) == 10
+
+    for vehicle, stop_time_update in joined:
+        if vehicle.route_id == "51A":
+            assert stop_time_update is not None
+            assert stop_time_update.stop_sequence == vehicle.current_stop_sequence
+            assert stop_time_update.arrival.time == vehicle.timestamp + 30
+        else:
+            assert stop_time_update is None
+
+
+def test_batch_writer(archive_dir: pathlib.Path) -> None:
+    last_timestamp = max(
+        frame.timestamp
+        for frame in archive.retrieve_feed_frames(archive_dir, START, END)
+    )
+
+    with archive.BatchWriter(archive_dir, max_snapshots=2) as writer:
+        for i in range(1, 4):
+            feed = make_feed("vehicles", last_timestamp + 60 * i)
+            writer.add("vehicles", feed)
+            writer.add("vehicles", feed)  # unchanged feeds are skipped
+
+    batches = sorted(path.name for path in archive_dir.glob("vehicles/**/*.batch"))
+    assert batches == [
+        f"{last_timestamp + 60}-{last_timestamp + 120}.vehicles.batch",
+        f"{last_timestamp + 180}-{last_timestamp + 180}.vehicles.batch",
+    ]
+
+    archived_feeds = list(
+        archive.list_archived_feeds(
+            "vehicles", archive_dir, START, END, after=last_timestamp - 60
+        )
+    )
+    assert [archived_feed.timestamp for archived_feed in archived_feeds] == [
+        last_timestamp + 60 * i for i in range(4)
+    ]
+
+    vehicles = list(archive.retrieve_vehicle_positions(archive_dir, START, END))
+    assert len(vehicles) == 16
+    assert vehicles[-1].timestamp == last_timestamp + 180
+
+
+def test_list_archived_feeds_every(archive_dir: pathlib.Path) -> None:
+    archived_feeds = list(
+        archive.list_archived_feeds(
+            "alerts", archive_dir, START, END, every=pendulum.duration(minutes=2)
+        )
+    )
+    timestamps = [archived_feed.timestamp for archived_feed in archived_feeds]
+
+    first = timestamps[0]
+    assert timestamps == [first, first + 120, first + 240]
+
+
+def test_batch_writer_stalled_feed(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    now = 0.0
+    monkeypatch.setattr(archive.time, "monotonic", lambda: now)
+
+    feed = make_feed("vehicles", START_TIMESTAMP)
+
+    with archive.BatchWriter(tmp_path, max_seconds=300.0) as writer:
+        writer.add("vehicles", feed)
+
+        # The feed stops updating, but its batch is still flushed by age
+        now = 400.0
+        writer.add("vehicles", feed)
+
+        batches = [path.name for path in tmp_path.glob("vehicles/**/*.batch")]
+        assert batches == [f"{START_TIMESTAMP}-{START_TIMESTAMP}.vehicles.batch"]
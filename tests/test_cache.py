@@ -0,0 +1,40 @@
+import time
+
+import orjson
+from pytest_mock import MockerFixture
+
+from actransit_rt.functions import cache, server
+
+from .conftest import make_feed
+
+
+def test_latest_feed_cache(mocker: MockerFixture) -> None:
+    timestamp = int(time.time())
+    retrieve = mocker.patch(
+        "actransit_rt.functions.gtfs.retrieve_vehicles_feed",
+        return_value=make_feed("vehicles", timestamp),
+    )
+
+    feed_cache = cache.LatestFeedCache("token", ttl=30)
+    client = server.create_app(feed_cache.get_snapshot).test_client()
+
+    res = client.get("/gtfsrt/vehicles")
+    assert res.status_code == 200
+    assert res.headers["ETag"] == f'"vehicles-{timestamp}"'
+
+    res = client.get("/gtfsrt/vehicles", headers={"If-None-Match": res.headers["ETag"]})
+    assert res.status_code == 304
+
+    res = client.get("/vehicles.json", query_string={"route_id": "NL"})
+    assert [vehicle["route_id"] for vehicle in orjson.loads(res.data)] == ["NL"]
+
+    # One upstream request serves every client until the feed expires
+    retrieve.assert_called_once_with(token="token")
+
+    retrieve.return_value = make_feed("vehicles", timestamp - 60)
+    feed_cache.ttl = 0
+    feed_cache.min_interval = 0
+
+    res = client.get("/gtfsrt/vehicles")
+    assert res.headers["ETag"] == f'"vehicles-{timestamp - 60}"'
+    assert retrieve.call_count == 2
@@ -1,6 +1,6 @@
 from click.testing import CliRunner
 
-from actransit_rt.cli import version
+from actransit_rt.cli import cli, version
 
 
 def test_version() -> None:
@@ -8,3 +8,12 @@ def test_version() -> None:
     result = runner.invoke(version)
     assert result.exit_code == 0
     assert result.output == "0.1.0\n"
+
+
+def test_every_rejects_zero_duration() -> None:
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["archive", "retrieve-tripupdates", "--input-dir", ".", "--every", "0m"]
+    )
+    assert result.exit_code == 2
+    assert "Must be a positive duration" in result.output
@@ -0,0 +1,196 @@
+import pathlib
+
+import pendulum
+import pyarrow.dataset as ds
+import pytest
+import smart_open
+
+from actransit_rt.functions import archive, export
+
+from .conftest import START_TIMESTAMP, make_feed, write_feed
+
+START = pendulum.datetime(2024, 2, 15, tz="America/Los_Angeles")
+END = START.end_of("day")
+
+
+def test_write_vehicle_positions_dataset(
+    archive_dir: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    output_dir = tmp_path / "dataset"
+
+    vehicles = archive.retrieve_vehicle_positions(archive_dir, START, END)
+    num_rows = export.write_vehicle_positions_dataset(
+        vehicles, output_dir, partition_by_route=True
+    )
+    assert num_rows == 10
+
+    partitions = sorted(
+        str(path.parent.relative_to(output_dir))
+        for path in output_dir.glob("**/*.parquet")
+    )
+    assert partitions == [
+        "service_date=20240215/route_id=51A",
+        "service_date=20240215/route_id=NL",
+    ]
+
+    table = ds.dataset(output_dir / partitions[0], format="parquet").to_table()
+    assert table["timestamp"].to_pylist() == sorted(table["timestamp"].to_pylist())
+
+    # Appending adds files without rewriting existing partitions
+    vehicles = archive.retrieve_vehicle_positions(archive_dir, START, END)
+    export.write_vehicle_positions_dataset(
+        vehicles, output_dir, partition_by_route=True
+    )
+
+    dataset = ds.dataset(output_dir, format="parquet", partitioning="hive")
+    assert dataset.count_rows(filter=ds.field("route_id") == "51A") == 10
+
+
+def test_write_vehicle_positions_dataset_skewed_clock(
+    archive_dir: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(export, "CHUNK_SIZE", 3)
+
+    # One vehicle reports a timestamp days ahead of the snapshot
+    feed = make_feed("vehicles", START_TIMESTAMP)
+    feed.entity[1].vehicle.timestamp = START_TIMESTAMP + 3 * 24 * 60 * 60
+
+    with smart_open.open(
+        str(archive.output_path("vehicles", archive_dir, START_TIMESTAMP)), "wb"
+    ) as fout:
+        fout.write(feed.SerializeToString())
+
+    output_dir = tmp_path / "dataset"
+
+    vehicles = archive.retrieve_vehicle_positions(archive_dir, START, END)
+    assert export.write_vehicle_positions_dataset(vehicles, output_dir) == 10
+
+    # The service date is not flushed early, so its file is sorted in one run
+    (path,) = output_dir.glob("**/*.parquet")
+    table = ds.dataset(path, format="parquet").to_table()
+    assert table["vehicle_id"].to_pylist() == ["vehicle-51A"] * 5 + ["vehicle-NL"] * 5
+
+
+def test_export_vehicle_positions_incremental(
+    archive_dir: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    output_dir = tmp_path / "dataset"
+
+    num_rows, watermark = export.export_vehicle_positions_incremental(
+        archive_dir, output_dir, START, END
+    )
+    assert num_rows == 10
+    assert export.read_watermarks(output_dir) == {"vehicles": watermark}
+
+    # Nothing new has been archived since the watermark
+    assert export.export_vehicle_positions_incremental(
+        archive_dir, output_dir, START, END
+    ) == (0, watermark)
+
+    assert watermark is not None
+    write_feed(archive_dir, "vehicles", watermark + 60)
+
+    num_rows, next_watermark = export.export_vehicle_positions_incremental(
+        archive_dir, output_dir, START, END
+    )
+    assert num_rows == 2
+    assert next_watermark == watermark + 60
+
+    dataset = ds.dataset(output_dir, format="parquet", partitioning="hive")
+    assert dataset.count_rows() == 12
+
+
+def test_write_vehicle_positions_dataset_chunks(
+    archive_dir: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(export, "CHUNK_SIZE", 3)
+
+    output_dir = tmp_path / "dataset"
+
+    vehicles = archive.retrieve_vehicle_positions(archive_dir, START, END)
+    assert export.write_vehicle_positions_dataset(vehicles, output_dir) == 10
+
+    # Chunks of the same service date are sorted together into one file
+    (path,) = output_dir.glob("**/*.parquet")
+    table = ds.dataset(path, format="parquet").to_table()
+    assert table["vehicle_id"].to_pylist() == ["vehicle-51A"] * 5 + ["vehicle-NL"] * 5
+    assert table["timestamp"].to_pylist()[:5] == sorted(
+        table["timestamp"][:5].to_pylist()
+    )
+
+
+def test_export_vehicle_positions_incremental_retry(
+    archive_dir: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    output_dir = tmp_path / "dataset"
+
+    def crash(*args: object) -> None:
+        raise RuntimeError("Crashed before committing the watermark")
+
+    # Crash after the dataset files are written
+    with monkeypatch.context() as m:
+        m.setattr(export, "write_watermark", crash)
+
+        with pytest.raises(RuntimeError):
+            export.export_vehicle_positions_incremental(
+                archive_dir, output_dir, START, END
+            )
+
+    # A snapshot archived before the retry is left for the next export
+    write_feed(archive_dir, "vehicles", START_TIMESTAMP + 60 * 5)
+
+    num_rows, watermark = export.export_vehicle_positions_incremental(
+        archive_dir, output_dir, START, END
+    )
+    assert num_rows == 10
+    assert watermark == START_TIMESTAMP + 60 * 4
+
+    num_rows, watermark = export.export_vehicle_positions_incremental(
+        archive_dir, output_dir, START, END
+    )
+    assert num_rows == 2
+    assert watermark == START_TIMESTAMP + 60 * 5
+
+    dataset = ds.dataset(output_dir, format="parquet", partitioning="hive")
+    assert dataset.count_rows() == 12
+
+
+def test_export_vehicle_positions_incremental_midnight(
+    archive_dir: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    output_dir = tmp_path / "dataset"
+
+    # Runs default start and end to the time of the run
+    run_at = pendulum.datetime(2024, 2, 15, 23, 51, tz="UTC")
+    num_rows, _ = export.export_vehicle_positions_incremental(
+        archive_dir, output_dir, run_at, run_at
+    )
+    assert num_rows == 10
+
+    late_timestamp = pendulum.datetime(2024, 2, 15, 23, 55, tz="UTC").int_timestamp
+    next_timestamp = pendulum.datetime(2024, 2, 16, 0, 5, tz="UTC").int_timestamp
+    write_feed(archive_dir, "vehicles", late_timestamp)
+    write_feed(archive_dir, "vehicles", next_timestamp)
+
+    def crash(*args: object) -> None:
+        raise RuntimeError("Crashed before committing the watermark")
+
+    run_at = pendulum.datetime(2024, 2, 16, 0, 6, tz="UTC")
+    with monkeypatch.context() as m:
+        m.setattr(export, "write_watermark", crash)
+
+        with pytest.raises(RuntimeError):
+            export.export_vehicle_positions_incremental(
+                archive_dir, output_dir, run_at, run_at
+            )
+
+    # The retry a day later still covers the late snapshot of the first day
+    run_at = pendulum.datetime(2024, 2, 17, 0, 6, tz="UTC")
+    num_rows, watermark = export.export_vehicle_positions_incremental(
+        archive_dir, output_dir, run_at, run_at
+    )
+    assert num_rows == 4
+    assert watermark == next_timestamp
+
+    dataset = ds.dataset(output_dir, format="parquet", partitioning="hive")
+    assert dataset.count_rows() == 14
@@ -1,7 +1,12 @@
 import pathlib
+import time
 
 import flask
+import pytest
 from functions_framework import create_app
+from pytest_mock import MockerFixture
+
+from .conftest import make_feed
 
 
 def test_hello() -> None:
@@ -11,3 +16,22 @@ def test_hello() -> None:
     res: flask.response = client.post("/", json={"name": "actransit"})
     assert res.status_code == 200
     assert res.data == b"Hello actransit!"
+
+
+def test_latest_feed(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    monkeypatch.setenv("ACTRANSIT_API_TOKEN", "token")
+    feed = make_feed("alerts", int(time.time()))
+    mocker.patch(
+        "requests.get",
+        return_value=mocker.Mock(status_code=200, content=feed.SerializeToString()),
+    )
+
+    app = create_app("latest_feed", pathlib.Path("src/actransit_rt/functions/main.py"))
+    app.testing = True  # bubble exceptions
+    client = app.test_client()
+
+    res: flask.response = client.get("/gtfsrt/alerts")
+    assert res.status_code == 200
+
+    res = client.get("/gtfsrt/unknown")
+    assert res.status_code == 404
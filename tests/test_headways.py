@@ -0,0 +1,48 @@
+import pandas as pd
+
+from actransit_rt.functions import headways, model
+
+STOPPED_AT = model.VehicleStopStatus.STOPPED_AT
+IN_TRANSIT_TO = model.VehicleStopStatus.IN_TRANSIT_TO
+
+
+def _positions(vehicle_id: str, offset: int) -> list[dict]:
+    observations = [
+        (1, STOPPED_AT, 0),
+        (1, STOPPED_AT, 30),  # repeated state
+        (2, IN_TRANSIT_TO, 60),  # stop 2 is passed without stopping
+        (3, IN_TRANSIT_TO, 120),
+        (3, STOPPED_AT, 150),
+    ]
+
+    return [
+        {
+            "route_id": "51A",
+            "direction_id": 0,
+            "trip_id": f"trip-{vehicle_id}",
+            "start_date": "20240215",
+            "vehicle_id": vehicle_id,
+            "current_stop_sequence": sequence,
+            "stop_id": f"stop-{sequence}",
+            "current_status": status,
+            "timestamp": offset + timestamp,
+        }
+        for sequence, status, timestamp in observations
+    ]
+
+
+def test_arrival_events_and_headways() -> None:
+    positions = pd.DataFrame(_positions("1001", 0) + _positions("1002", 600))
+
+    arrivals = headways.arrival_events(positions)
+    first_trip = arrivals[arrivals["vehicle_id"] == "1001"]
+    assert first_trip["stop_id"].tolist() == ["stop-1", "stop-2", "stop-3"]
+    assert first_trip["arrival_timestamp"].tolist() == [0, 120, 150]
+    assert first_trip["arrival_type"].tolist() == ["stopped", "passed", "stopped"]
+
+    headway_df = headways.headways(arrivals)
+    assert headway_df["headway_seconds"].tolist() == [600, 600, 600]
+
+    summary = headways.headway_summary(headway_df)
+    assert summary["count"].tolist() == [1, 1, 1]
+    assert summary["median"].tolist() == [600, 600, 600]
@@ -0,0 +1,105 @@
+import pathlib
+
+import pendulum
+import pyarrow as pa
+import pytest
+
+from actransit_rt.functions import archive, export, materialize
+
+from .conftest import START_TIMESTAMP, write_feed
+
+START = pendulum.datetime(2024, 2, 15, tz="America/Los_Angeles")
+END = START.end_of("day")
+
+
+def test_materialize_vehicle_positions(
+    archive_dir: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    cache_dir = tmp_path / "cache"
+
+    cached = list(
+        materialize.materialize_vehicle_positions(archive_dir, cache_dir, START, END)
+    )
+    assert [num_rows for _, num_rows in cached] == [10]
+
+    allocated = pa.total_allocated_bytes()
+    table = materialize.read_vehicle_positions_cache(cache_dir, START, END)
+    assert table.num_rows == 10
+    assert pa.total_allocated_bytes() == allocated
+
+    # Cached days are read without an archive
+    expected = list(archive.retrieve_vehicle_positions(archive_dir, START, END))
+
+    vehicles = materialize.retrieve_vehicle_positions(None, cache_dir, START, END)
+    assert list(vehicles) == expected
+
+
+def test_retrieve_vehicle_positions_stale_cache(
+    archive_dir: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cache_dir = tmp_path / "cache"
+
+    # The day was still being archived when it was materialized
+    materialized_at = pendulum.from_timestamp(START_TIMESTAMP + 60 * 5)
+    with monkeypatch.context() as m:
+        m.setattr(pendulum, "now", lambda *args: materialized_at)
+        list(
+            materialize.materialize_vehicle_positions(
+                archive_dir, cache_dir, START, END
+            )
+        )
+
+    write_feed(archive_dir, "vehicles", START_TIMESTAMP + 60 * 5)
+
+    vehicles = list(
+        materialize.retrieve_vehicle_positions(archive_dir, cache_dir, START, END)
+    )
+    assert len(vehicles) == 12
+    assert vehicles == list(archive.retrieve_vehicle_positions(archive_dir, START, END))
+
+    table = materialize.read_vehicle_positions_cache(
+        cache_dir, START, END, input_dir=archive_dir
+    )
+    assert table.num_rows == 12
+
+    # Without an archive to compare against, the cache is trusted
+    table = materialize.read_vehicle_positions_cache(cache_dir, START, END)
+    assert table.num_rows == 10
+
+    cached = list(
+        materialize.materialize_vehicle_positions(archive_dir, cache_dir, START, END)
+    )
+    assert [num_rows for _, num_rows in cached] == [12]
+
+    path, _ = cached[0]
+    assert materialize.cached_until(path) == START_TIMESTAMP + 60 * 5
+
+    # Days materialized long after they ended are not checked against the archive
+    write_feed(archive_dir, "vehicles", START_TIMESTAMP + 60 * 6)
+
+    vehicles = list(
+        materialize.retrieve_vehicle_positions(archive_dir, cache_dir, START, END)
+    )
+    assert len(vehicles) == 12
+
+
+def test_materialize_vehicle_positions_chunks(
+    archive_dir: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(export, "CHUNK_SIZE", 3)
+
+    cache_dir = tmp_path / "cache"
+
+    ((path, num_rows),) = materialize.materialize_vehicle_positions(
+        archive_dir, cache_dir, START, END
+    )
+    assert num_rows == 10
+
+    table = materialize.read_cached_day(path)
+    assert table.to_batches()[0].num_rows == 3
+    assert (
+        table.to_pylist()
+        == export.vehicle_positions_table(
+            archive.retrieve_vehicle_positions(archive_dir, START, END)
+        ).to_pylist()
+    )
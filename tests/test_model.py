@@ -0,0 +1,25 @@
+import datetime
+
+from actransit_rt.functions import model
+
+from .conftest import make_feed
+
+
+def test_vehicle_position_from_feed() -> None:
+    feed = make_feed("vehicles", 1708020000)
+    vehicle = model.VehiclePosition.from_feed(feed.entity[0])
+
+    assert not hasattr(vehicle, "__dict__")
+    assert vehicle.route_id == "51A"
+    assert vehicle.current_status == model.VehicleStopStatus.STOPPED_AT
+    assert vehicle.timestamp_datetime == datetime.datetime(
+        2024, 2, 15, 18, 0, tzinfo=datetime.UTC
+    )
+
+    assert vehicle.start_datetime is not None
+    assert vehicle.start_datetime.strftime("%Y-%m-%d %H:%M") == "2024-02-15 09:55"
+    assert vehicle.start_datetime.utcoffset() == datetime.timedelta(hours=-8)
+
+    row = vehicle.to_dict()
+    assert list(row)[5:8] == ["start_time", "start_datetime", "schedule_relationship"]
+    assert row["timestamp_datetime"] == vehicle.timestamp_datetime
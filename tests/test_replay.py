@@ -0,0 +1,41 @@
+import pathlib
+
+import pendulum
+from google.transit import gtfs_realtime_pb2
+
+from actransit_rt.functions import replay, server
+
+START = pendulum.datetime(2024, 2, 15, tz="America/Los_Angeles")
+END = START.end_of("day")
+
+
+def test_replay(archive_dir: pathlib.Path) -> None:
+    replayer = replay.Replayer(archive_dir, START, END, speed=0)
+
+    client = server.create_app(replayer.get_snapshot).test_client()
+    assert client.get("/gtfsrt/vehicles").status_code == 503
+
+    timestamps = [int(feed.header.timestamp) for _, feed in replayer.feeds()]
+    assert len(timestamps) == 15
+    assert timestamps == sorted(timestamps)
+
+    replayer.run()
+
+    for kind in server.FEED_KINDS:
+        res = client.get(f"/gtfsrt/{kind}", query_string={"token": "ignored"})
+        assert res.status_code == 200
+
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(res.data)
+        assert feed.header.timestamp == timestamps[-1]
+
+    assert client.get("/gtfsrt/unknown").status_code == 404
+
+
+def test_replay_loop_without_snapshots(tmp_path: pathlib.Path) -> None:
+    replayer = replay.Replayer(tmp_path, START, END, speed=0, loop=True)
+
+    # Returns rather than re-listing the empty archive forever
+    replayer.run()
+
+    assert replayer.get_snapshot("vehicles") is None